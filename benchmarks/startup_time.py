@@ -0,0 +1,51 @@
+"""
+Checks that starting numpy_alignments does not import heavy dependencies, and that startup time
+is not much higher than starting python. Exits with status 1 on regression.
+
+python3 benchmarks/startup_time.py [max overhead in ms, default 100]
+"""
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ["numpy", "bionumpy", "plotly", "tqdm", "graph_read_simulator", "shared_memory_wrapper"]
+N_RUNS = 10
+
+
+def time_command(code):
+    times = []
+    for i in range(N_RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    max_overhead = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.1
+
+    imported = subprocess.run(
+        [sys.executable, "-c", "import sys, numpy_alignments.command_line_interface; "
+                               "print(' '.join(m for m in %r if m in sys.modules))" % HEAVY_MODULES],
+        check=True, capture_output=True, text=True).stdout.split()
+
+    python_time = time_command("pass")
+    cli_time = time_command("from numpy_alignments.command_line_interface import run_argument_parser; "
+                            "run_argument_parser(['rename', '-p', '/dev/null'])")
+    overhead = cli_time - python_time
+    print("python startup: %.1f ms, numpy_alignments rename: %.1f ms, overhead: %.1f ms"
+          % (python_time * 1000, cli_time * 1000, overhead * 1000))
+
+    ok = True
+    if len(imported) > 0:
+        print("Heavy modules imported at startup: %s" % ", ".join(imported))
+        ok = False
+    if overhead > max_overhead:
+        print("Startup overhead is above %.1f ms" % (max_overhead * 1000))
+        ok = False
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
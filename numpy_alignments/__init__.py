@@ -1,2 +1,11 @@
-from .numpy_alignments import NumpyAlignments
-from .comparer import Comparer
\ No newline at end of file
+# NumpyAlignments and Comparer are imported when first used, so that the command line interface starts fast
+
+
+def __getattr__(name):
+    if name == "NumpyAlignments":
+        from .numpy_alignments import NumpyAlignments
+        return NumpyAlignments
+    elif name == "Comparer":
+        from .comparer import Comparer
+        return Comparer
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,36 @@
+import warnings
+import numpy as np
+
+# Bootstrap confidence intervals computed on histograms of counts (e.g. number of correct and wrong alignments
+# for each mapq) instead of on reads. Resampling N reads with replacement gives histogram counts drawn from a
+# multinomial distribution with N trials and the observed frequencies, so a bootstrap sample costs time
+# proportional to the number of histogram cells, not the number of reads.
+
+N_SAMPLES = 1000
+
+
+def resample_histogram(counts, n_samples=N_SAMPLES, seed=1):
+    # Returns n_samples bootstrap samples of the histogram (one row per sample)
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros((n_samples, len(counts)), dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    return rng.multinomial(total, counts / total, size=n_samples)
+
+
+def divide(numerator, denominator):
+    # Elementwise division that gives nan instead of warnings when dividing by zero
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator != 0, numerator / denominator, np.nan)
+
+
+def interval(samples, confidence=0.95):
+    # Percentile interval over the bootstrap samples (axis 0). nan samples are ignored
+    alpha = (1 - confidence) / 2 * 100
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all samples nan
+        low, high = np.nanpercentile(np.asarray(samples, dtype=float), [alpha, 100 - alpha], axis=0)
+    return low, high
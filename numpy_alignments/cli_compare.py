@@ -0,0 +1,147 @@
+import logging
+import numpy as np
+from .comparer import Comparer
+from .numpy_alignments import NumpyAlignments
+from .region_index import parse_regions
+from .sampling import common_sample, common_sampling, sample_mask, sampling_metadata
+
+# Commands comparing alignments to the truth (see command_line_interface.py)
+
+
+def _read_alignments_to_compare(truth_file_name, compare_file_names, sample_fraction=None, regions=None):
+    # Returns truth and {name: alignments}, all subsampled to the same reads if any of them are sampled
+    # or sample_fraction is set. If regions is set (see region_index.parse_regions), only reads with truth
+    # position in the regions are included, found with the region index of the truth alignments
+    logging.info("Reading alignments from file")
+    alignments = [NumpyAlignments.from_file(truth_file_name)] + [NumpyAlignments.from_file(name) for name in compare_file_names]
+    if regions is None:
+        alignments = common_sample(alignments, sample_fraction)
+    else:
+        truth = alignments[0]
+        regions = parse_regions(regions, truth.metadata.get("contigs"))
+        read_ids = truth.get_read_ids(truth.get_region_index().rows_in_regions(regions))
+        sampling = common_sampling(alignments, sample_fraction)
+        if sampling is not None:
+            read_ids = read_ids[sample_mask(read_ids, *sampling)]
+        logging.info("%d reads in regions" % len(read_ids))
+        alignments = [a.take_reads(read_ids) for a in alignments]
+        for a in alignments:
+            if sampling is not None:
+                a.metadata["sampling"] = sampling_metadata(*sampling)
+
+    return alignments[0], dict(zip(compare_file_names, alignments[1:]))
+
+
+def set_correctness(args):
+    logging.info("Reading alignments")
+    truth = NumpyAlignments.from_file(args.truth_alignments)
+    alignments = NumpyAlignments.from_file(args.alignments)
+    logging.info("Setting correctness")
+    alignments.is_correct = None
+    alignments.set_correctness(truth, force=True)
+    alignments.to_file(args.alignments)
+    logging.info("Correctness was set and file written to same file again")
+
+
+def get_correct_rates(args):
+    truth_alignments, compare_alignments = _read_alignments_to_compare(args.truth_alignments, args.compare_alignments.split(","),
+                                                                       args.sample_fraction, args.region)
+
+    type = args.type #edit
+    
+    logging.info("Comparing..")
+    comparer = Comparer(truth_alignments, compare_alignments, type=type, allowed_mismatch=args.allowed_bp_mismatch) #edit
+    rates = comparer.get_correct_rates(args.min_mapq, confidence=args.confidence)
+    for name, rate in rates.items():
+        recall = rate[0]
+        one_minus_precision = rate[1]
+        precision = 1 - one_minus_precision
+        # with --confidence, the interval (low, high) is printed after recall and 1 - precision
+        recall_interval = "" if args.confidence is None else " %s %s" % rate[2]
+        one_minus_precision_interval = "" if args.confidence is None else " %s %s" % rate[3]
+
+        if args.report_type == "all":
+            print(name, str(rate[0]) + recall_interval, str(rate[1]) + one_minus_precision_interval)
+        elif args.report_type == "recall":
+            print(str(recall) + recall_interval)
+        elif args.report_type == "one_minus_precision":
+            print(str(one_minus_precision) + one_minus_precision_interval)
+        elif args.report_type == "f1_score":
+            f1 = 2 * precision * recall / (precision + recall)
+            print(f1)
+        else:
+            raise Exception("Invalid report type")
+
+
+def get_correct_rates_multi(args):
+    truth_alignments = NumpyAlignments.from_file(args.truth_alignments)
+
+    n_correct = 0
+    with open(args.compare_alignments) as f:
+        reads_checked = set()
+        for line in f:
+            l = line.split()
+            name = l[3]
+            pos = int(l[1])
+
+            correct_pos = truth_alignments.positions[int(name)]
+            if abs(correct_pos-pos) < args.allowed_bp_mismatch and name not in reads_checked:
+                n_correct += 1
+                reads_checked.add(name)
+
+    logging.info("N correct: %d" % n_correct)
+    logging.info("Rate: %.3f" % (n_correct / len(truth_alignments.positions)))
+
+
+def compare_alignments(args):
+    names = args.compare_alignments.split(",")
+    truth_alignments, compare_alignments = _read_alignments_to_compare(args.truth_alignments, names, args.sample_fraction, args.region)
+    if args.limit_to_n_reads is not None and args.sample_fraction is None:
+        fraction = min(1, args.limit_to_n_reads / max(len(truth_alignments.positions), 1))
+        logging.warning("--limit-to-n-reads is replaced by --sample-fraction. Comparing a sample of %.4f of the reads" % fraction)
+        alignments = common_sample([truth_alignments] + [compare_alignments[name] for name in names], fraction)
+        truth_alignments, compare_alignments = alignments[0], dict(zip(names, alignments[1:]))
+
+    logging.info("Comparing")
+    for type in ["all", "variants", "nonvariants"]:
+        comparer = Comparer(truth_alignments, compare_alignments, type=type, allowed_mismatch=args.allowed_mismatch)
+        save_to_file = None
+        if args.save_to_file is not None:
+            save_to_file = args.save_to_file + "_" + type + ".html"
+        comparer.create_roc_plots(save_to_file=save_to_file)
+
+    #comparer.get_wrong_alignments_correct_by_other("two_step_approach", "vg_chr20")
+    #comparer.get_wrong_alignments_correct_by_other("bwa_10m_tuned", "vg_10m")
+
+
+def intersections(args):
+    truth_alignments, compare_alignments = _read_alignments_to_compare(args.truth_alignments, args.compare_alignments.split(","),
+                                                                       args.sample_fraction)
+    comparer = Comparer(truth_alignments, compare_alignments, type=args.type, allowed_mismatch=args.allowed_bp_mismatch)
+
+    codes, counts = comparer.get_intersection_counts(args.min_mapq)
+    for code, count in sorted(zip(codes, counts), key=lambda c: -c[1]):
+        description = comparer.describe_code(code, args.min_mapq)
+        print("%d\t%s" % (count, "\t".join("%s:%s" % (key, ",".join(value)) for key, value in description.items())))
+
+    if args.out_file is not None:
+        split = lambda names: names.split(",") if names is not None else []
+        read_ids = comparer.get_read_ids_matching(split(args.correct_by), split(args.wrong_by), split(args.confident_by), args.min_mapq)
+        Comparer.write_read_ids(read_ids, args.out_file)
+
+
+def pair_metrics(args):
+    truth_alignments, compare_alignments = _read_alignments_to_compare(args.truth_alignments, args.compare_alignments.split(","),
+                                                                       args.sample_fraction, args.region)
+    comparer = Comparer(truth_alignments, compare_alignments, allowed_mismatch=args.allowed_bp_mismatch)
+    print("name\tn_pairs\tboth_correct\tone_correct\tnone_correct\tdiscordant\tproper_both_correct\tproper_one_correct\tproper_none_correct")
+    for name, metrics in comparer.get_pair_metrics(args.max_fragment_length).items():
+        n_pairs = max(metrics["n_pairs"], 1)
+        rates = [metrics[key] / n_pairs for key in ["both_correct", "one_correct", "none_correct", "discordant"]]
+        # rate of pairs flagged as proper pair among pairs with 2, 1 and 0 correct mates
+        if "proper_pairs_by_n_correct" in metrics:
+            proper = metrics["proper_pairs_by_n_correct"][::-1] / np.maximum(metrics["n_pairs_by_n_correct"][::-1], 1)
+            proper = ["%.5f" % rate for rate in proper]
+        else:
+            proper = ["NA"] * 3
+        print("%s\t%d\t%s\t%s" % (name, metrics["n_pairs"], "\t".join("%.5f" % rate for rate in rates), "\t".join(proper)))
@@ -0,0 +1,40 @@
+import logging
+import sys
+import numpy as np
+from .fastq_index import build_index, extract, index_file_name, write_index
+from .numpy_alignments import NumpyAlignments
+from .sampling import common_sample
+
+# Commands indexing fastq files and extracting reads from them (see command_line_interface.py)
+
+
+def index_fastq(args):
+    write_index(build_index(args.fq), index_file_name(args.fq))
+
+
+def extract_reads(args):
+    alignments = None
+    if args.alignments is not None:
+        alignments = NumpyAlignments.from_file(args.alignments)
+
+    if args.read_ids is not None:
+        read_ids = np.loadtxt(args.read_ids, dtype=np.int64, ndmin=1)
+    else:
+        assert args.truth_alignments is not None and alignments is not None, \
+            "Either --read-ids or both --truth-alignments and --alignments must be specified"
+        truth_alignments, alignments = common_sample([NumpyAlignments.from_file(args.truth_alignments), alignments])
+        alignments.set_correctness(truth_alignments, allowed_mismatch=args.allowed_bp_mismatch)
+        selection = alignments.correct_mask()
+        if args.wrong:
+            selection = ~selection
+        read_ids = alignments.get_read_ids(np.flatnonzero(selection & (alignments.mapqs >= args.min_mapq)))
+
+    logging.info("Extracting %d reads" % len(read_ids))
+    if args.output_format == "bed" and alignments is None:
+        alignments = NumpyAlignments.from_file(args.truth_alignments)
+
+    if args.out_file == "-":
+        extract(args.fq, read_ids, sys.stdout.buffer, args.output_format, alignments)
+    else:
+        with open(args.out_file, "wb") as f:
+            extract(args.fq, read_ids, f, args.output_format, alignments)
@@ -0,0 +1,72 @@
+import logging
+import os
+import sys
+from time import time
+from .cli_compare import _read_alignments_to_compare
+from .comparer import ALLOWED_MISMATCH, MAPQ_INTERVALS, Comparer
+from .htmlreport import make_report
+from .roc_cache import RocCache, fingerprint
+
+# The make_report command (see command_line_interface.py)
+
+
+def make_html_report_wrapper(args):
+    if args.report_id is not None:
+        report_id = args.report_id
+    else:
+        report_id = str(time()).split(".")[0]
+
+    if not os.path.isdir(report_id):
+        os.mkdir(report_id)
+
+    logging.info("Report will be in directory %s" % report_id)
+
+    ids = args.compare_alignments.split(",")
+
+    if args.names is not None:
+        names = args.names.split(",")
+        names = {name: names[i] for i, name in enumerate(ids)}
+    else:
+        names = {name: name for name in ids}
+
+    colors = args.colors.split(",")
+    colors = {name: colors[i] for i, name in enumerate(ids)}
+
+    if len(colors) != len(names) or len(names) != len(ids):
+        logging.error("Not enough names/colors/alignments. Numbers do not match")
+        sys.exit()
+
+    # Curves are cached by file fingerprints, so only new or changed alignments are compared
+    types = ["all", "variants", "nonvariants"]
+    confidence = args.confidence if args.confidence > 0 else None
+    # a bed file is part of the cache key by its fingerprint
+    regions = fingerprint(args.region) if args.region is not None and os.path.isfile(args.region) else args.region
+    cache = RocCache(args.cache_dir) if not args.no_cache else None
+    parameters = {type: dict(allowed_mismatch=ALLOWED_MISMATCH, type=type, mapq_intervals=MAPQ_INTERVALS, confidence=confidence,
+                             sample_fraction=args.sample_fraction, regions=regions)
+                  for type in types}
+    curves = {type: {} for type in types}
+    missing = []
+    for type in types:
+        for name in ids:
+            curve = cache.get(name, args.truth_alignments, **parameters[type]) if cache is not None else None
+            if curve is None:
+                missing.append((type, name))
+            else:
+                curves[type][name] = curve
+    logging.info("%d of %d curves found in cache" % (len(types) * len(ids) - len(missing), len(types) * len(ids)))
+
+    if len(missing) > 0:
+        truth_alignments, compare_alignments = _read_alignments_to_compare(
+            args.truth_alignments, [name for name in ids if any(name == m for _, m in missing)], args.sample_fraction, args.region)
+        for type in types:
+            comparer = Comparer(truth_alignments, compare_alignments, colors, type=type, allowed_mismatch=ALLOWED_MISMATCH)
+            for name in [m for t, m in missing if t == type]:
+                curves[type][name] = comparer.compute_roc_curve(name, confidence=confidence)
+                if cache is not None:
+                    cache.put(name, args.truth_alignments, curves[type][name], **parameters[type])
+
+    html = make_report(curves, ids, names, colors, static=args.static)
+    with open(report_id + "/report.html", "w") as f:
+        f.write(html)
+    logging.info("Final report written to %s/report.html" % report_id)
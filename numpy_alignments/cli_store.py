@@ -0,0 +1,67 @@
+import logging
+import sys
+from contextlib import nullcontext
+from .numpy_alignments import NumpyAlignments, NumpyAlignments2
+from .pipeline import ingest
+from .region_index import RegionIndex
+from .variants import VariantPositions
+
+# Commands storing alignments (see command_line_interface.py)
+
+
+def store_alignments(args):
+    if args.type in ("pos", "truth", "bed", "vgpos"):
+        # text formats are written directly to the store while reading
+        with (open(args.input, "rb") if args.input is not None else nullcontext(sys.stdin.buffer)) as input_file:
+            ingest(input_file, args.type, args.file_name, args.n_alignments, n_threads=args.threads,
+                   sample_fraction=args.sample_fraction, sample_seed=args.sample_seed)
+        variants = _read_variants(args)
+        build_region_index = args.type == "truth" and not args.no_region_index
+        if variants is not None or build_region_index:
+            a = NumpyAlignments.from_file(args.file_name)
+            if variants is not None:
+                variants.annotate(a, args.read_length)
+            if build_region_index:
+                # index of reads sorted by truth position, for comparing reads in regions
+                a.region_index = RegionIndex.from_alignments(a.chromosomes, a.positions)
+            a.to_file(args.file_name)
+        return
+    elif args.type == "sam":
+        a = NumpyAlignments.from_sam(args.n_alignments)
+    elif args.type == "bam":
+        if args.n_variants is not None:
+            a = NumpyAlignments2.from_bam_and_nvariants_txt(args.input, args.n_variants)
+        else:
+            a = NumpyAlignments2.from_bam(args.input)
+    else:
+        logging.error("Invalid type %s" % args.type)
+        sys.exit()
+
+    variants = _read_variants(args)
+    if variants is not None:
+        variants.annotate(a, args.read_length)
+
+    if args.sample_fraction is not None:
+        if a.metadata["sort_order"] != "read_id":
+            # rows are not read ids (e.g. bam, sorted by read name), so the sample would not match other alignments
+            raise Exception("Sampling is not supported for %s (alignments are sorted by %s, not read id)"
+                            % (args.type, a.metadata["sort_order"]))
+        a = a.subsample(args.sample_fraction, args.sample_seed)
+
+    a.to_file(args.file_name)
+
+
+def _read_variants(args):
+    if args.coordinate_map is not None:
+        return VariantPositions.from_coordinate_map(args.coordinate_map)
+    elif args.vcf is not None:
+        return VariantPositions.from_vcf(args.vcf)
+    return None
+
+
+def annotate_variants(args):
+    variants = _read_variants(args)
+    assert variants is not None, "Either --coordinate-map or --vcf must be specified"
+    alignments = NumpyAlignments.from_file(args.file_name)
+    variants.annotate(alignments, args.read_length)
+    alignments.to_file(args.file_name)
@@ -0,0 +1,80 @@
+import logging
+import numpy as np
+
+INT32_MAX = np.iinfo(np.int32).max
+INT32_MIN = np.iinfo(np.int32).min
+
+# number of set bits in every possible byte
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+class PackedBoolArray:
+    # Boolean column stored with np.packbits, using one bit per element.
+    # Indexing unpacks only the requested elements.
+    def __init__(self, packed, length):
+        assert len(packed) == (length + 7) // 8, "Packed array has %d bytes, expected %d" % (len(packed), (length + 7) // 8)
+        self.packed = packed
+        self._length = length
+
+    @classmethod
+    def from_array(cls, array):
+        array = np.asarray(array)
+        return cls(np.packbits(array != 0), len(array))
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self._length)
+            if step != 1:
+                return self[np.arange(start, stop, step)]
+            stop = max(start, stop)
+            bits = np.unpackbits(self.packed[start // 8:(stop + 7) // 8])
+            return bits[start % 8:start % 8 + stop - start].view(bool)
+
+        if np.isscalar(item):
+            if item < 0:
+                item += self._length
+            return bool((self.packed[item >> 3] >> (7 - (item & 7))) & 1)
+
+        item = np.asarray(item)
+        if item.dtype == bool:
+            item = np.flatnonzero(item)
+        item = item.astype(np.int64, copy=False)
+        item = np.where(item < 0, item + self._length, item)
+        return ((self.packed[item >> 3] >> (7 - (item & 7))) & 1).astype(bool)
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.to_array()
+        return array if dtype is None else array.astype(dtype)
+
+    def to_array(self):
+        return np.unpackbits(self.packed, count=self._length).view(bool)
+
+    def count_nonzero(self):
+        # packbits pads with zeros, so padding bits are never counted
+        return int(_POPCOUNT[self.packed].sum(dtype=np.int64))
+
+
+def narrow_positions(positions):
+    # Positions are signed (so that they can be subtracted) and int32 unless some position does not fit
+    positions = np.asarray(positions)
+    if positions.dtype == np.int32:
+        return positions  # not scanned, which would read all of a memory mapped column
+    if len(positions) == 0 or np.can_cast(positions.dtype, np.int32):
+        return positions.astype(np.int32)
+
+    fits_int32 = positions.max() <= INT32_MAX and positions.min() >= INT32_MIN
+    if fits_int32:
+        return positions if positions.dtype == np.int32 else positions.astype(np.int32)
+
+    return positions if positions.dtype == np.int64 else positions.astype(np.int64)
+
+
+def widen_positions(positions, position):
+    # Call before setting position in an int32 positions array. Returns an int64 copy if position does not fit
+    if positions.dtype == np.int32 and not INT32_MIN <= position <= INT32_MAX:
+        logging.info("Position %d does not fit in int32. Using int64 for positions" % position)
+        return positions.astype(np.int64)
+    return positions
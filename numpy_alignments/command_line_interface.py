@@ -1,164 +1,45 @@
 import logging
-import bionumpy as bnp
 logging.basicConfig(level=logging.INFO)
 import argparse
-from .numpy_alignments import NumpyAlignments, NumpyAlignments2
-from .comparer import Comparer
 import sys
-from .htmlreport import make_report
+
+# numpy_alignments is run many times in pipelines, often for short jobs, so commands with heavy dependencies
+# (numpy, bionumpy, plotly, ...) are in their own modules, which are imported when the command is run and not
+# when this module is imported.
+
+# Subcommands, as name: "module:function" (module relative to this package). Only the module of the command
+# that is run is imported, and the function is called with the parsed arguments
+COMMANDS = {
+    "store": ".cli_store:store_alignments",
+    "annotate_variants": ".cli_store:annotate_variants",
+    "compare": ".cli_compare:compare_alignments",
+    "get_correct_rates": ".cli_compare:get_correct_rates",
+    "get_correct_rates_multi": ".cli_compare:get_correct_rates_multi",
+    "make_report": ".cli_report:make_html_report_wrapper",
+    "intersections": ".cli_compare:intersections",
+    "pair_metrics": ".cli_compare:pair_metrics",
+    "set_correctness": ".cli_compare:set_correctness",
+    "convert": ".command_line_interface:convert_file",
+    "rename": ".command_line_interface:rename",
+    "index": ".cli_extract:index_fastq",
+    "extract": ".cli_extract:extract_reads",
+}
 
 
 def main():
     run_argument_parser(sys.argv[1:])
 
 
+def run_command(name, args):
+    import importlib
+    module_name, function_name = COMMANDS[name].split(":")
+    getattr(importlib.import_module(module_name, __package__), function_name)(args)
 
-def set_correctness(args):
-    logging.info("Reading alignments")
-    truth = NumpyAlignments.from_file(args.truth_alignments)
-    alignments = NumpyAlignments.from_file(args.alignments)
-    logging.info("Setting correctness")
-    alignments.is_correct = None
-    alignments.set_correctness(truth, force=True)
-    alignments.to_file(args.alignments)
-    logging.info("Correctness was set and file written to same file again")
-
-
-def make_html_report_wrapper(args):
-    from time import time
-    import os
-
-
-    if args.report_id is not None:
-        report_id = args.report_id
-    else:
-        report_id = str(time()).split(".")[0]
-
-    if not os.path.isdir(report_id):
-        os.mkdir(report_id)
-
-    logging.info("Report will be in directory %s" % report_id)
-
-    # Make
-    truth_alignments = NumpyAlignments.from_file(args.truth_alignments)
-    ids = args.compare_alignments.split(",")
-    compare_alignments = {c: NumpyAlignments.from_file(c) for c in args.compare_alignments.split(",")}
-
-    if args.names is not None:
-        names = args.names.split(",")
-        names = {name: names[i] for i, name in enumerate(ids)}
-    else:
-        names = {name: name for name in ids}
-
-    colors = args.colors.split(",")
-    colors = {name: colors[i] for i, name in enumerate(ids)}
-
-    if len(colors) != len(names) or len(names) != len(compare_alignments):
-        logging.error("Not enough names/colors/alignments. Numbers do not match")
-        sys.exit()
-
-    logging.info("Making plots")
-    for type in ["all", "variants", "nonvariants"]:
-        comparer = Comparer(truth_alignments, compare_alignments, colors, type=type)
-        comparer.create_roc_plots(save_to_file=report_id + "/" + type + ".html")
-
-    html = make_report(report_id, ids, names, colors)
-    with open(report_id + "/report.html", "w") as f:
-        f.write(html)
-    logging.info("Final report written to %s/report.html" % report_id)
-
-
-def store_alignments(args):
-    if args.type == "pos":
-        a = NumpyAlignments.from_pos(args.n_alignments)
-    elif args.type == "sam":
-        a = NumpyAlignments.from_sam(args.n_alignments)
-    elif args.type == "truth":
-        a = NumpyAlignments.from_truth(args.n_alignments)
-    elif args.type == "bed":
-        a = NumpyAlignments.from_bed(args.n_alignments)
-    elif args.type == "vgpos":
-        a = NumpyAlignments.from_vgpos(args.n_alignments)
-    elif args.type == "bam":
-        if args.n_variants is not None:
-            a = NumpyAlignments2.from_bam_and_nvariants_txt(args.input, args.n_variants)
-        else:
-            a = NumpyAlignments2.from_bam(args.input)
-    else:
-        logging.error("Invalid type %s" % args.type)
-        sys.exit()
-
-    a.to_file(args.file_name)
-
-
-def get_correct_rates(args):
-    logging.info("Reading alignments from file")
-    try:
-        truth_alignments = NumpyAlignments.from_file(args.truth_alignments)
-    except KeyError:
-        truth_alignments = NumpyAlignments2.from_file(args.truth_alignments)
-
-    try:
-        compare_alignments = {c: NumpyAlignments.from_file(c) for c in args.compare_alignments.split(",")}
-    except KeyError:
-        compare_alignments = {c: NumpyAlignments2.from_file(c) for c in args.compare_alignments.split(",")}
-
-    type = args.type #edit
-    
-    logging.info("Comparing..")
-    comparer = Comparer(truth_alignments, compare_alignments, type=type, allowed_mismatch=args.allowed_bp_mismatch) #edit
-    rates = comparer.get_correct_rates(args.min_mapq)
-    for name, rate in rates.items():
-        recall = rate[0]
-        one_minus_precision = rate[1]
-        precision = 1 - one_minus_precision
-
-        if args.report_type == "all":
-            print(name, rate[0], rate[1])
-        elif args.report_type == "recall":
-            print(recall)
-        elif args.report_type == "one_minus_precision":
-            print(one_minus_precision)
-        elif args.report_type == "f1_score":
-            f1 = 2 * precision * recall / (precision + recall)
-            print(f1)
-        else:
-            raise Exception("Invalid report type")
-
-def get_correct_rates_multi(args):
-    truth_alignments = NumpyAlignments.from_file(args.truth_alignments)
-
-    n_correct = 0
-    with open(args.compare_alignments) as f:
-        reads_checked = set()
-        for line in f:
-            l = line.split()
-            name = l[3]
-            pos = int(l[1])
-
-            correct_pos = truth_alignments.positions[int(name)]
-            if abs(correct_pos-pos) < args.allowed_bp_mismatch and name not in reads_checked:
-                n_correct += 1
-                reads_checked.add(name)
-
-    logging.info("N correct: %d" % n_correct)
-    logging.info("Rate: %.3f" % (n_correct / len(truth_alignments.positions)))
-
-def compare_alignments(args):
-    logging.info("Reading alignments from file")
-    truth_alignments = NumpyAlignments.from_file(args.truth_alignments)
-    compare_alignments = {c: NumpyAlignments.from_file(c) for c in args.compare_alignments.split(",")}
-
-    logging.info("Comparing")
-    for type in ["all", "variants", "nonvariants"]:
-        comparer = Comparer(truth_alignments, compare_alignments, type=type, allowed_mismatch=args.allowed_mismatch)
-        save_to_file = None
-        if args.save_to_file is not None:
-            save_to_file = args.save_to_file + "_" + type + ".html"
-        comparer.create_roc_plots(save_to_file=save_to_file, limit_comparison=args.limit_to_n_reads)
 
-    #comparer.get_wrong_alignments_correct_by_other("two_step_approach", "vg_chr20")
-    #comparer.get_wrong_alignments_correct_by_other("bwa_10m_tuned", "vg_10m")
+def convert_file(args):
+    from .store import convert, store_file_name
+    new_file_name = store_file_name(args.new_file_name if args.new_file_name is not None else args.old_file_name)
+    convert(args.old_file_name, new_file_name)
 
 
 def rename(args):
@@ -181,14 +62,28 @@ def rename(args):
         else:
             f = open(args.fq)
 
+        # byte offsets of records in the renamed output, only kept if an index is to be written
+        import array
+        offsets = array.array("Q", [0]) if args.index is not None else None
+        offset = 0
         for i, line in enumerate(f):
             if i % 4 != 0:
-                print(line.strip())
+                out_line = line.strip()
             else:
-                print("@%09d" % (i//4))
+                out_line = "@%09d" % (i//4)
+            print(out_line)
 
-    logging.info("Done")
+            if offsets is not None:
+                offset += len(out_line) + 1
+                if i % 4 == 3:
+                    offsets.append(offset)
+
+        if offsets is not None:
+            import numpy as np
+            from .fastq_index import write_index
+            write_index(np.frombuffer(offsets, dtype=np.uint64), args.index)
 
+    logging.info("Done")
 
 
 def run_argument_parser(args):
@@ -197,17 +92,29 @@ def run_argument_parser(args):
         prog='numpy_alignments',
         formatter_class=lambda prog: argparse.HelpFormatter(prog, max_help_position=50, width=100))
 
-    subparsers = parser.add_subparsers()
+    subparsers = parser.add_subparsers(dest="command")
 
     # Store alignments
     store = subparsers.add_parser("store")
-    store.add_argument("-c", "--coordinate-map", required=False, help="If set, can use coordinate map to count variants (only supported for SAM-files)")
-    store.add_argument("-i", "--input", required=False)
+    store.add_argument("-c", "--coordinate-map", required=False, help="If set, n_variants is the number of variants in the coordinate map covered by each read")
+    store.add_argument("-v", "--vcf", required=False, help="If set, n_variants is the number of variants in this vcf covered by each read")
+    store.add_argument("-r", "--read-length", type=int, default=150, help="Read length used when counting variants covered by reads")
+    store.add_argument("-i", "--input", required=False, help="Input file (bam, or a text format instead of reading from stdin)")
+    store.add_argument("-t", "--threads", type=int, default=1, help="Number of threads parsing text formats")
+    store.add_argument("-s", "--sample-fraction", type=float, help="Only store a sample of this fraction of the reads (selected by a hash of the read id)")
+    store.add_argument("--sample-seed", type=int, default=0, help="Seed of the read sample")
+    store.add_argument("--no-region-index", action="store_true", help="Do not index truth alignments by position (the index makes comparing reads in regions fast)")
     store.add_argument("-n", "--n_variants", required=False)
     store.add_argument("type", help="Type of alignments. Either sam, pos or truth.")
     store.add_argument("file_name", help="File name to store alignments to")
     store.add_argument("n_alignments", help="Must be >= number of alignments that is expected", type=int)
-    store.set_defaults(func=store_alignments)
+
+    # Set n_variants of stored (truth) alignments from variants covered by each read
+    cmd = subparsers.add_parser("annotate_variants")
+    cmd.add_argument("file_name", help="Alignments to annotate, typically truth alignments")
+    cmd.add_argument("-c", "--coordinate-map", required=False, help="Coordinate map from graph_read_simulator")
+    cmd.add_argument("-v", "--vcf", required=False)
+    cmd.add_argument("-r", "--read-length", type=int, default=150)
 
     # Compare alignments
     compare = subparsers.add_parser("compare")
@@ -215,8 +122,9 @@ def run_argument_parser(args):
     compare.add_argument("compare_alignments", help="Comma-separated list of files to compare")
     compare.add_argument("-f", "--save-to-file", help="File name to save figure to (jpg)")
     compare.add_argument("-m", "--allowed-mismatch", help="Maximum number of bp between read position and correct position in order for read to considered as correctly mapped.", type=int, default=150)
-    compare.add_argument("-l", "--limit-to-n-reads", help="Limit comparison to max this number of reads in order to make things faster", required=False, type=int, default=None)
-    compare.set_defaults(func=compare_alignments)
+    compare.add_argument("-R", "--region", help="Only include reads with truth position in these regions: a bed file or comma-separated chr:start-end")
+    compare.add_argument("-l", "--limit-to-n-reads", help="Deprecated, use --sample-fraction. Compares a sample of about this number of reads", required=False, type=int, default=None)
+    compare.add_argument("-s", "--sample-fraction", type=float, help="Compare only a sample of this fraction of the reads (selected by a hash of the read id)")
 
     # Compare (get correct rates)
     compare = subparsers.add_parser("get_correct_rates")
@@ -226,7 +134,9 @@ def run_argument_parser(args):
     compare.add_argument("-m", "--min-mapq", type=int, default=0)
     compare.add_argument("-t", "--allowed-bp-mismatch", type=int, default=150)
     compare.add_argument("-r", "--report-type", default="all", help="all, recall, one_minus_precision, f1_score")
-    compare.set_defaults(func=get_correct_rates)
+    compare.add_argument("-R", "--region", help="Only include reads with truth position in these regions: a bed file or comma-separated chr:start-end")
+    compare.add_argument("-c", "--confidence", type=float, help="If set (e.g. 0.95), also print bootstrap confidence intervals of recall and 1 - precision")
+    compare.add_argument("-s", "--sample-fraction", type=float, help="Compare only a sample of this fraction of the reads (selected by a hash of the read id)")
 
     #
     compare = subparsers.add_parser("get_correct_rates_multi")
@@ -235,7 +145,6 @@ def run_argument_parser(args):
     compare.add_argument("type")
     compare.add_argument("-m", "--min-mapq", type=int, default=0)
     compare.add_argument("-t", "--allowed-bp-mismatch", type=int, default=150)
-    compare.set_defaults(func=get_correct_rates_multi)
 
     # Make ROC html report
     cmd = subparsers.add_parser("make_report")
@@ -244,23 +153,73 @@ def run_argument_parser(args):
     cmd.add_argument("-n", "--names", help="Comma-separated pretty readable names (corresponding to compare_alignments)")
     cmd.add_argument("colors", help="Comma-separated list of colors (must work with html)")
     cmd.add_argument("-f", "--report-id", required=False, default=None, help="Will be generated if not specified")
-    cmd.set_defaults(func=make_html_report_wrapper)
+    cmd.add_argument("--cache-dir", help="Directory for cached ROC curves (default $XDG_CACHE_HOME/numpy_alignments)")
+    cmd.add_argument("--no-cache", action="store_true", help="Compute all ROC curves without using the cache")
+    cmd.add_argument("-c", "--confidence", type=float, default=0.95, help="Show bootstrap confidence intervals at this level (0 to not show intervals)")
+    cmd.add_argument("-R", "--region", help="Only include reads with truth position in these regions: a bed file or comma-separated chr:start-end")
+    cmd.add_argument("-s", "--sample-fraction", type=float, help="Compare only a sample of this fraction of the reads (selected by a hash of the read id)")
+    cmd.add_argument("-S", "--static", action="store_true", help="Draw plots as static svg instead of with plotly.js (smaller, no javascript)")
+
+    # Counts of reads correctly aligned by each combination of aligners (UpSet-style)
+    cmd = subparsers.add_parser("intersections")
+    cmd.add_argument("truth_alignments")
+    cmd.add_argument("compare_alignments", help="Comma-separated list of files to compare")
+    cmd.add_argument("-T", "--type", default="all", help="all, variants or nonvariants")
+    cmd.add_argument("-m", "--min-mapq", type=int, default=None, help="If set, also count which aligners have mapq >= this")
+    cmd.add_argument("-t", "--allowed-bp-mismatch", type=int, default=150)
+    cmd.add_argument("-c", "--correct-by", help="Comma-separated list of alignments that should be correct for reads written to --out-file")
+    cmd.add_argument("-w", "--wrong-by", help="Comma-separated list of alignments that should be wrong for reads written to --out-file")
+    cmd.add_argument("-q", "--confident-by", help="Comma-separated list of alignments that should have mapq >= --min-mapq for reads written to --out-file")
+    cmd.add_argument("-o", "--out-file", help="Write ids of reads matching the given pattern to this file")
+    cmd.add_argument("-s", "--sample-fraction", type=float, help="Compare only a sample of this fraction of the reads (selected by a hash of the read id)")
+
+    # Pair-level metrics for paired-end reads
+    cmd = subparsers.add_parser("pair_metrics")
+    cmd.add_argument("truth_alignments")
+    cmd.add_argument("compare_alignments", help="Comma-separated list of files to compare")
+    cmd.add_argument("-t", "--allowed-bp-mismatch", type=int, default=150)
+    cmd.add_argument("-f", "--max-fragment-length", type=int, default=1000, help="Pairs with mates further apart than this (or on different chromosomes) are discordant")
+    cmd.add_argument("-s", "--sample-fraction", type=float, help="Compare only a sample of this fraction of the pairs (selected by a hash of the read id)")
+    cmd.add_argument("-R", "--region", help="Only compare reads with truth position in these regions (bed file or comma-separated chr:start-end)")
 
     # Set correctness
     cmd = subparsers.add_parser("set_correctness")
     cmd.add_argument("truth_alignments")
     cmd.add_argument("alignments")
-    cmd.set_defaults(func=set_correctness)
+
+    # Convert files written by older versions to the current file format
+    cmd = subparsers.add_parser("convert")
+    cmd.add_argument("old_file_name")
+    cmd.add_argument("new_file_name", nargs="?", default=None, help="Default is old file name with .npa instead of .npz")
 
     # rename fq file to numeric increasing ids
     cmd = subparsers.add_parser("rename")
     cmd.add_argument("-q", "--fq", required=False)
     cmd.add_argument("-p", "--posfile", required=False)
-    cmd.set_defaults(func=rename)
+    cmd.add_argument("-x", "--index", required=False, help="Write an index of the renamed fastq to this file (name it <fq>.nai to have extract find it)")
+
+    # Index fastq file for extraction of reads
+    cmd = subparsers.add_parser("index")
+    cmd.add_argument("fq", help="Fastq file with reads named by rename")
+
+    # Extract reads from indexed fastq file
+    cmd = subparsers.add_parser("extract")
+    cmd.add_argument("fq", help="Fastq file with reads named by rename. Will be indexed if no index is found")
+    cmd.add_argument("out_file", help="File to write reads to (- for stdout)")
+    cmd.add_argument("-i", "--read-ids", help="File with one read id per line")
+    cmd.add_argument("-t", "--truth-alignments", help="Select reads by correctness against these truth alignments")
+    cmd.add_argument("-a", "--alignments", help="Alignments to select reads from. Also used as coordinates when writing bed")
+    cmd.add_argument("-w", "--wrong", action="store_true", help="Select wrongly aligned reads (default is correctly aligned)")
+    cmd.add_argument("-m", "--min-mapq", type=int, default=0)
+    cmd.add_argument("-b", "--allowed-bp-mismatch", type=int, default=150)
+    cmd.add_argument("-f", "--output-format", default="fastq", help="fastq or bed")
 
     if len(args) == 0:
         parser.print_help()
         sys.exit(1)
 
     args = parser.parse_args(args)
-    args.func(args)
+    if args.command is None:
+        parser.print_help()
+        sys.exit(1)
+    run_command(args.command, args)
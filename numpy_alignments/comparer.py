@@ -1,56 +1,45 @@
 import logging
 import numpy as np
-import plotly.graph_objects as go
-import plotly
+from .bootstrap import N_SAMPLES, divide, interval, resample_histogram
 
+ALLOWED_MISMATCH = 150
+MAPQ_INTERVALS = [60, 58, 57, 56, 55, 54, 53, 52, 51, 50, 49, 48, 46, 44, 42, 40, 37, 34, 30, 27, 25, 23, 20, 17, 14, 10, 6, 3, 2, 1, 0]
+
+
+def default_colors(names):
+    colors = ["blue", "red", "green", "purple", "orange", "black"]
+    return {name: colors[i] for i, name in enumerate(names)}
 
 
 class Comparer:
-    def __init__(self, truth_alignments, compare_alignments, colors=None, type='all', allowed_mismatch=150):
+    def __init__(self, truth_alignments, compare_alignments, colors=None, type='all', allowed_mismatch=ALLOWED_MISMATCH):
         self.truth_alignments = truth_alignments
         self.compare_alignments = compare_alignments
         self.type = type
-        self.mapq_intervals = [60, 58, 57, 56, 55, 54, 53, 52, 51, 50, 49, 48, 46, 44, 42, 40, 37, 34, 30, 27, 25, 23, 20, 17, 14, 10, 6, 3, 2, 1, 0]
+        self.mapq_intervals = MAPQ_INTERVALS
         logging.info("Allowed mismatch in bp is %d" % allowed_mismatch)
         self.allowed_mismatch = allowed_mismatch
 
-        default_colors = ["blue", "red", "green", "purple", "orange", "black"]
-        if colors is None:
-            colors = {c: default_colors[i] for i, c in enumerate(self.compare_alignments.keys())}
-
-        self.colors = colors
+        self.colors = colors if colors is not None else default_colors(self.compare_alignments.keys())
 
-    def get_correct_rates(self, min_mapq=0):
+    def get_correct_rates(self, min_mapq=0, confidence=None, n_bootstrap=N_SAMPLES):
+        # Returns {name: (recall, 1 - precision)}. If confidence is set (e.g. 0.95), bootstrap confidence intervals
+        # ((low, high) of recall and of 1 - precision) are added to each tuple
 
         for name, alignments in self.compare_alignments.items():
             logging.info("Setting corectness for %s, allowed mismatch: %d" % (name, self.allowed_mismatch))
             alignments.set_correctness(self.truth_alignments, allowed_mismatch=self.allowed_mismatch)
 
-        if self.type == "all":
-            n_alignments = len(self.truth_alignments.positions)
-        elif self.type == "variants":
-            n_alignments = len(np.where((self.truth_alignments.n_variants > 0))[0])
-        elif self.type == "nonvariants":
-            n_alignments = len(np.where(self.truth_alignments.n_variants == 0)[0])
-        else:
-            raise Exception("Invalid type (must be all, variants or nonvariants)")
+        type_mask = self._type_mask()
+        n_alignments = len(self.truth_alignments.positions) if type_mask is None else np.count_nonzero(type_mask)
 
         rates = {}
         for name, alignments in self.compare_alignments.items():
             logging.info("Processing %s" % name)
             compare = self.compare_alignments[name]
-            if self.type == "all":
-                selection = compare.positions[np.where((compare.is_correct == 1) & (compare.mapqs >= min_mapq))[0]]
-                selection_wrong = compare.positions[np.where((compare.is_correct == 0) & (compare.mapqs >= min_mapq))[0]]
-            elif self.type == "variants":
-                selection = compare.positions[np.where((compare.is_correct == 1) & (compare.n_variants > 0) & (compare.mapqs >= min_mapq))[0]]
-                selection_wrong = compare.positions[np.where((compare.is_correct == 0) & (compare.n_variants > 0) & (compare.mapqs >= min_mapq))[0]]
-            elif self.type == "nonvariants":
-                selection = compare.positions[np.where((compare.is_correct == 1) & (compare.n_variants == 0) & (compare.mapqs >= min_mapq))[0]]
-                selection_wrong = compare.positions[np.where((compare.is_correct == 0) & (compare.n_variants == 0) & (compare.mapqs >= min_mapq))[0]]
-
-            n_correct = len(selection)
-            n_wrong = len(selection_wrong)
+            correct_histogram, wrong_histogram = self._mapq_histograms(compare, type_mask)
+            n_correct = int(correct_histogram[min_mapq:].sum())
+            n_wrong = int(wrong_histogram[min_mapq:].sum())
 
             try:
                 rates[name] = (n_correct / n_alignments, (n_wrong / (n_wrong + n_correct)))  # np.sum(self.compare_alignments[name].is_correct) / len(self.truth_alignments.positions)
@@ -60,133 +49,267 @@ class Comparer:
                 rates[name] = (0, 0)
                 #raise
 
-        return rates
-
-    def create_roc_plots(self, save_to_file=None, limit_comparison=None):
-        mapq_intervals = self.mapq_intervals
-
-        for name, alignments in self.compare_alignments.items():
-            logging.info("Setting corectness for %s" % name)
-            alignments.set_correctness(self.truth_alignments)
+            if confidence is not None:
+                rates[name] += self._correct_rate_intervals(correct_histogram, wrong_histogram, n_alignments, min_mapq,
+                                                            confidence, n_bootstrap)
 
+        return rates
 
-        recalls = {name: [] for name in self.compare_alignments.keys()}
-        precision = {name: [] for name in self.compare_alignments.keys()}
-        n_reads = {name: [] for name in self.compare_alignments.keys()}
-
+    def get_pair_metrics(self, max_fragment_length=None):
+        # Returns {name: pair metrics} (see pairs.pair_metrics) for paired-end reads
+        from .pairs import MAX_FRAGMENT_LENGTH, pair_metrics
+        max_fragment_length = max_fragment_length if max_fragment_length is not None else MAX_FRAGMENT_LENGTH
+        # mates are rows 2k and 2k + 1 only in stores of paired-end reads
+        for name, alignments in [("truth", self.truth_alignments)] + list(self.compare_alignments.items()):
+            if not alignments.metadata.get("paired", False):
+                raise Exception("Alignments %s are not paired-end (no read with sam flag 0x1 or a /1 or /2 name when stored)" % name)
+        metrics = {}
         for name, alignments in self.compare_alignments.items():
-            logging.info("Processing %s" % name)
-            if self.type == "all":
-                total = len(alignments.n_variants)
-            elif self.type == "variants":
-                total = len(np.where(alignments.n_variants > 0)[0])
-            elif self.type == "nonvariants":
-                total = len(np.where(alignments.n_variants == 0)[0])
-            else:
-                raise Exception("Invalig type %s" % type)
-
-            #total = len(np.where(self.truth_alignments.n_variants > -1)[0])
-            recalled_total = 0
-            n_wrong_total = 0
-
-            prev_interval = 100
-            for mapq in mapq_intervals:
-                #logging.info("mapq: %d" % mapq)
-                upper_limit = prev_interval
-                lower_limit = mapq
-
-                alignments = self.compare_alignments[name]
-                if self.type == "all":
-                    selection = np.where((alignments.mapqs >= lower_limit) & (alignments.mapqs < upper_limit))[0]
-                elif self.type == "variants":
-                    selection = np.where((alignments.mapqs >= lower_limit) & (alignments.mapqs < upper_limit) & (alignments.n_variants > 0))[0]
-                elif self.type == "nonvariants":
-                    selection = np.where((alignments.mapqs >= lower_limit) & (alignments.mapqs < upper_limit) & (alignments.n_variants == 0))[0]
-
-                if limit_comparison is not None:
-                    selection = selection[0:limit_comparison]
-                    logging.warning("Limiting comparison to max %d reads" % limit_comparison)
-
-                #print("N with mapq >= %d and < %d: %d" % (lower_limit, upper_limit, len(selection)))
-
-                # Find number of recalled and number of wrong here
-                n_correct = np.sum(alignments.is_correct[selection])
-                n_wrong = len(selection) - n_correct
-
-                recalled_total += n_correct
-                n_wrong_total += n_wrong
-
-                recalls[name].append(recalled_total / total)
-                precision[name].append((n_wrong_total + 1) / (n_wrong_total + recalled_total))
-                n_reads[name].append(np.log(1 + len(selection)))
-
-
-                prev_interval = mapq
-
-        fig = go.Figure(
-            layout=go.Layout(
-                xaxis=dict(showgrid=True, zeroline=True),
-            )
-        )
-        #fig.update_layout(title_text="Reads (%s)" % self.type)
-        fig.update_layout(xaxis_type="log")
-        fig.update_layout(
-            xaxis = dict(
-                showexponent = 'all',
-                exponentformat = 'e',
-                nticks=5,
-                tickfont=dict(
-                    size=16
-                )
-        ))
-        fig.update_layout(
-            yaxis = dict(
-                tickfont=dict(
-                    size=16
-                )
-            ),
-            xaxis_title="#wrong mapped / #mapped",
-            yaxis_title="#correctly mapped / total"
-        )
-        fig.update_layout(showlegend=False)
-
-
-
-        ticker_positions = ["top left", "bottom left", "top left", "bottom left", "top left", "bottom left", "top left", "bottom left"]
-        for i, name in enumerate(self.compare_alignments.keys()):
-            ticker_text = [m if m % 10 == 0 else None for m in self.mapq_intervals]
-
-
-            sizes = np.array(n_reads[name])
-            fig.add_trace(go.Scatter(x=precision[name], y=recalls[name],
-                                     text=ticker_text,
-                                     mode='markers+lines+text',
-                                     textposition=ticker_positions[i],
-                                     name=name,
-                                     textfont=dict(
-                                        size=16
-                                     ),
-                                     marker=dict(
-                                         sizemode='area',
-                                         sizeref=4. * max(sizes) / (40. ** 2),
-                                         sizemin=7,
-                                         color=self.colors[name]
-                                         )
-                                     ),
-                          )
-
-        if save_to_file is not None:
-            #plt.savefig(save_to_file)
-            plotly.offline.plot(fig, filename=save_to_file, auto_open=False)
-            logging.info("Saved plot to %s" % save_to_file)
+            logging.info("Setting corectness for %s, allowed mismatch: %d" % (name, self.allowed_mismatch))
+            alignments.set_correctness(self.truth_alignments, allowed_mismatch=self.allowed_mismatch)
+            metrics[name] = pair_metrics(alignments, max_fragment_length)
+        return metrics
+
+    def _mapq_histograms(self, alignments, type_mask=None):
+        # Number of correct and wrong alignments for each mapq
+        mapqs = np.asarray(alignments.mapqs)
+        is_correct = alignments.correct_mask()
+        if type_mask is not None:
+            mapqs = mapqs[type_mask]
+            is_correct = is_correct[type_mask]
+        length = max(256, int(mapqs.max()) + 1 if len(mapqs) > 0 else 0)
+        return np.bincount(mapqs[is_correct], minlength=length), np.bincount(mapqs[~is_correct], minlength=length)
+
+    def _correct_rate_intervals(self, correct_histogram, wrong_histogram, n_alignments, min_mapq, confidence, n_bootstrap):
+        # Bootstrap on the mapq histograms. Reads not in the histograms (if any) are one extra cell
+        n_rest = max(n_alignments - int(correct_histogram.sum()) - int(wrong_histogram.sum()), 0)
+        samples = resample_histogram(np.concatenate([correct_histogram, wrong_histogram, [n_rest]]), n_bootstrap)
+        n_mapqs = len(correct_histogram)
+        n_correct = samples[:, min_mapq:n_mapqs].sum(axis=1)
+        n_wrong = samples[:, n_mapqs + min_mapq:2 * n_mapqs].sum(axis=1)
+        return interval(divide(n_correct, n_alignments), confidence), interval(divide(n_wrong, n_correct + n_wrong), confidence)
+
+    def create_roc_plots(self, save_to_file=None):
+        curves = {name: self.compute_roc_curve(name) for name in self.compare_alignments.keys()}
+        plot_roc_curves(curves, self.colors, save_to_file)
+
+    def compute_roc_curve(self, name, confidence=None, n_bootstrap=N_SAMPLES):
+        # Recall and 1 - precision of an aligner for reads with mapq above each of the mapq intervals.
+        # If confidence is set, the curve also has bootstrap confidence intervals (*_low and *_high) of both
+        logging.info("Setting corectness for %s" % name)
+        alignments = self.compare_alignments[name]
+        alignments.set_correctness(self.truth_alignments, allowed_mismatch=self.allowed_mismatch)
+
+        logging.info("Processing %s" % name)
+        if self.type == "all":
+            total = len(alignments.positions)
+            type_mask = None
+        elif self.type == "variants":
+            type_mask = alignments.variants_mask()
+            total = np.count_nonzero(type_mask)
+        elif self.type == "nonvariants":
+            type_mask = ~alignments.variants_mask()
+            total = np.count_nonzero(type_mask)
         else:
-            fig.show()
-
-
-    def get_wrong_alignments_correct_by_other(self, wrong_by, correct_by):
-        selection_correct = set(list(np.nonzero(self.compare_alignments[correct_by].is_correct)[0]))
-        selection_wrong = set(list(np.where(self.compare_alignments[wrong_by].is_correct == 0)[0]))
-        selection_mapq = set(list(np.where(self.compare_alignments[wrong_by].mapqs >= 30)[0]))
-
-        selection = selection_correct.intersection(selection_wrong).intersection(selection_mapq)
+            raise Exception("Invalig type %s" % type)
+
+        recalls = []
+        precision = []
+        n_reads = []
+        n_correct_histogram = []
+        n_wrong_histogram = []
+        recalled_total = 0
+        n_wrong_total = 0
+
+        prev_interval = 100
+        for mapq in self.mapq_intervals:
+            upper_limit = prev_interval
+            lower_limit = mapq
+
+            selection = (alignments.mapqs >= lower_limit) & (alignments.mapqs < upper_limit)
+            if type_mask is not None:
+                selection &= type_mask
+            selection = np.where(selection)[0]
+
+            # Find number of recalled and number of wrong here
+            n_correct = alignments.count_correct(selection)
+            n_wrong = len(selection) - n_correct
+
+            recalled_total += n_correct
+            n_wrong_total += n_wrong
+            n_correct_histogram.append(n_correct)
+            n_wrong_histogram.append(n_wrong)
+
+            recalls.append(recalled_total / total)
+            precision.append((n_wrong_total + 1) / (n_wrong_total + recalled_total))
+            n_reads.append(np.log(1 + len(selection)))
+
+            prev_interval = mapq
+
+        curve = {"mapqs": list(self.mapq_intervals), "recall": recalls, "one_minus_precision": precision,
+                 "log_n_reads": [float(n) for n in n_reads]}
+        if confidence is not None:
+            curve.update(self._roc_intervals(n_correct_histogram, n_wrong_histogram, total, confidence, n_bootstrap))
+        return curve
+
+    def _roc_intervals(self, n_correct, n_wrong, total, confidence, n_bootstrap):
+        # Bootstrap on the number of correct and wrong alignments in each mapq interval
+        n_intervals = len(n_correct)
+        n_rest = max(int(total) - int(np.sum(n_correct)) - int(np.sum(n_wrong)), 0)
+        samples = resample_histogram(np.concatenate([n_correct, n_wrong, [n_rest]]), n_bootstrap)
+        recalled_total = np.cumsum(samples[:, :n_intervals], axis=1)
+        n_wrong_total = np.cumsum(samples[:, n_intervals:2 * n_intervals], axis=1)
+        recall_low, recall_high = interval(divide(recalled_total, total), confidence)
+        precision_low, precision_high = interval(divide(n_wrong_total + 1, n_wrong_total + recalled_total), confidence)
+        return {"recall_low": recall_low.tolist(), "recall_high": recall_high.tolist(),
+                "one_minus_precision_low": precision_low.tolist(), "one_minus_precision_high": precision_high.tolist()}
+
+    def _type_mask(self):
+        # Boolean mask of the reads included in self.type, None means all reads
+        if self.type == "all":
+            return None
+        elif self.type == "variants":
+            return self.truth_alignments.variants_mask()
+        elif self.type == "nonvariants":
+            return ~self.truth_alignments.variants_mask()
+        else:
+            raise Exception("Invalid type (must be all, variants or nonvariants)")
 
+    def get_correctness_codes(self, min_mapq=None):
+        # Packs is_correct of every aligner into one integer per read (bit i is set if aligner i is correct).
+        # If min_mapq is set, bit n_aligners + i is set if aligner i has mapq >= min_mapq
+        names = list(self.compare_alignments.keys())
+        n_bits = len(names) * (1 if min_mapq is None else 2)
+        if n_bits > 64:
+            raise Exception("Too many aligners (%d) to pack into one code per read" % len(names))
+
+        dtype = next(t for t in (np.uint8, np.uint16, np.uint32, np.uint64) if np.dtype(t).itemsize * 8 >= n_bits)
+        codes = np.zeros(len(self.truth_alignments.positions), dtype=dtype)
+        for i, name in enumerate(names):
+            alignments = self.compare_alignments[name]
+            alignments.set_correctness(self.truth_alignments, allowed_mismatch=self.allowed_mismatch)
+            codes |= alignments.correct_mask().astype(dtype) << dtype(i)
+            if min_mapq is not None:
+                codes |= (alignments.mapqs >= min_mapq).astype(dtype) << dtype(len(names) + i)
+
+        return codes
+
+    def get_intersection_counts(self, min_mapq=None):
+        # Returns all codes (see get_correctness_codes) that are observed and the number of reads having each code,
+        # i.e. the size of every intersection of correct (and confident) aligners
+        codes = self.get_correctness_codes(min_mapq)
+        type_mask = self._type_mask()
+        if type_mask is not None:
+            codes = codes[type_mask]
+
+        n_bits = len(self.compare_alignments) * (1 if min_mapq is None else 2)
+        if n_bits <= 24:
+            counts = np.bincount(codes, minlength=2**n_bits)
+            observed = np.flatnonzero(counts)
+            return observed, counts[observed]
+
+        return np.unique(codes, return_counts=True)
+
+    def describe_code(self, code, min_mapq=None):
+        names = list(self.compare_alignments.keys())
+        correct = [name for i, name in enumerate(names) if (int(code) >> i) & 1]
+        description = {"correct": correct}
+        if min_mapq is not None:
+            description["confident"] = [name for i, name in enumerate(names) if (int(code) >> (len(names) + i)) & 1]
+        return description
+
+    def get_read_ids_matching(self, correct_by=(), wrong_by=(), confident_by=(), min_mapq=None):
+        # Returns ids of reads that are correctly aligned by all of correct_by, wrongly aligned by all of wrong_by
+        # and have mapq >= min_mapq for all of confident_by
+        if len(confident_by) > 0 and min_mapq is None:
+            raise Exception("min_mapq must be set when requiring confident alignments")
+
+        names = list(self.compare_alignments.keys())
+        mask = 0
+        value = 0
+        for name in correct_by:
+            mask |= 1 << names.index(name)
+            value |= 1 << names.index(name)
+        for name in wrong_by:
+            mask |= 1 << names.index(name)
+        for name in confident_by:
+            mask |= 1 << (len(names) + names.index(name))
+            value |= 1 << (len(names) + names.index(name))
+
+        codes = self.get_correctness_codes(min_mapq)
+        selection = (codes & codes.dtype.type(mask)) == value
+        type_mask = self._type_mask()
+        if type_mask is not None:
+            selection &= type_mask
+
+        return self.truth_alignments.get_read_ids(np.flatnonzero(selection))
+
+    @staticmethod
+    def write_read_ids(read_ids, file_name):
+        np.savetxt(file_name, read_ids, fmt="%d")
+        logging.info("Wrote %d read ids to %s" % (len(read_ids), file_name))
+
+    def get_wrong_alignments_correct_by_other(self, wrong_by, correct_by, min_mapq=30):
+        return self.get_read_ids_matching(correct_by=[correct_by], wrong_by=[wrong_by], confident_by=[wrong_by],
+                                          min_mapq=min_mapq)
+
+
+def plot_roc_curves(curves, colors, save_to_file=None):
+    # curves: {name: curve from Comparer.compute_roc_curve}
+    import plotly.graph_objects as go
+    import plotly
+
+    fig = go.Figure(
+        layout=go.Layout(
+            xaxis=dict(showgrid=True, zeroline=True),
+        )
+    )
+    #fig.update_layout(title_text="Reads (%s)" % self.type)
+    fig.update_layout(xaxis_type="log")
+    fig.update_layout(
+        xaxis = dict(
+            showexponent = 'all',
+            exponentformat = 'e',
+            nticks=5,
+            tickfont=dict(
+                size=16
+            )
+    ))
+    fig.update_layout(
+        yaxis = dict(
+            tickfont=dict(
+                size=16
+            )
+        ),
+        xaxis_title="#wrong mapped / #mapped",
+        yaxis_title="#correctly mapped / total"
+    )
+    fig.update_layout(showlegend=False)
+
+    ticker_positions = ["top left", "bottom left", "top left", "bottom left", "top left", "bottom left", "top left", "bottom left"]
+    for i, (name, curve) in enumerate(curves.items()):
+        ticker_text = [m if m % 10 == 0 else None for m in curve["mapqs"]]
+
+        sizes = np.array(curve["log_n_reads"])
+        fig.add_trace(go.Scatter(x=curve["one_minus_precision"], y=curve["recall"],
+                                 text=ticker_text,
+                                 mode='markers+lines+text',
+                                 textposition=ticker_positions[i % len(ticker_positions)],
+                                 name=name,
+                                 textfont=dict(
+                                    size=16
+                                 ),
+                                 marker=dict(
+                                     sizemode='area',
+                                     sizeref=4. * max(sizes) / (40. ** 2),
+                                     sizemin=7,
+                                     color=colors[name]
+                                     )
+                                 ),
+                      )
+
+    if save_to_file is not None:
+        plotly.offline.plot(fig, filename=save_to_file, auto_open=False)
+        logging.info("Saved plot to %s" % save_to_file)
+    else:
+        fig.show()
@@ -0,0 +1,119 @@
+import logging
+import os
+import numpy as np
+
+
+# An index is an array of byte offsets of every record in a fastq file (record i starts at offsets[i] and ends at
+# offsets[i+1]). For files written by rename, record i is the read with id i.
+
+def index_file_name(fastq_file_name):
+    return fastq_file_name + ".nai"
+
+
+def write_index(offsets, file_name):
+    with open(file_name, "wb") as f:
+        np.save(f, np.asarray(offsets, dtype=np.uint64))
+    logging.info("Wrote index of %d reads to %s" % (len(offsets) - 1, file_name))
+
+
+def read_index(file_name):
+    return np.load(file_name, mmap_mode="r")
+
+
+def build_index(fastq_file_name, chunk_size=64 * 1024 * 1024):
+    # Finds the offset of every 4th line by scanning the file in large chunks
+    offsets = [np.array([0], dtype=np.uint64)]
+    n_lines = 0
+    file_offset = 0
+    ends_with_newline = True
+    with open(fastq_file_name, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if len(chunk) == 0:
+                break
+            line_ends = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n"))
+            # the line ending on line n_lines + k starts record (n_lines + k + 1) / 4 when that is whole
+            first = (3 - n_lines) % 4
+            offsets.append(line_ends[first::4].astype(np.uint64) + np.uint64(file_offset + 1))
+            n_lines += len(line_ends)
+            file_offset += len(chunk)
+            ends_with_newline = chunk.endswith(b"\n")
+
+    offsets = np.concatenate(offsets)
+    if n_lines % 4 == 3 and not ends_with_newline:
+        # last line has no line ending
+        offsets = np.append(offsets, np.uint64(file_offset))
+    elif n_lines % 4 != 0:
+        logging.warning("Number of lines in %s is not divisible by 4. Ignoring last incomplete record" % fastq_file_name)
+    return offsets
+
+
+def get_index(fastq_file_name):
+    file_name = index_file_name(fastq_file_name)
+    if os.path.isfile(file_name) and os.path.getmtime(file_name) >= os.path.getmtime(fastq_file_name):
+        return read_index(file_name)
+
+    logging.info("No up-to-date index found for %s. Building index" % fastq_file_name)
+    offsets = build_index(fastq_file_name)
+    write_index(offsets, file_name)
+    return offsets
+
+
+def _coalesce(starts, ends, max_gap, max_block_size):
+    # Groups sorted records into ranges that are read with a single read call
+    breaks = np.flatnonzero(starts[1:] - ends[:-1] > max_gap) + 1
+    bounds = np.concatenate([[0], breaks, [len(starts)]])
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        while first < last:
+            end = first + np.searchsorted(ends[first:last], starts[first] + max_block_size, side="right")
+            end = max(end, first + 1)
+            yield first, end
+            first = end
+
+
+def get_records(fastq_file_name, read_ids, offsets=None, max_gap=1024 * 1024, max_block_size=64 * 1024 * 1024):
+    # Yields (read_id, record bytes) for the given read ids in sorted order
+    if offsets is None:
+        offsets = get_index(fastq_file_name)
+
+    read_ids = np.unique(np.asarray(read_ids, dtype=np.int64))
+    n_records = len(offsets) - 1
+    if len(read_ids) > 0 and (read_ids[0] < 0 or read_ids[-1] >= n_records):
+        raise Exception("Read ids must be between 0 and %d" % (n_records - 1))
+
+    starts = np.asarray(offsets[read_ids], dtype=np.int64)
+    ends = np.asarray(offsets[read_ids + 1], dtype=np.int64)
+
+    n_read_calls = 0
+    with open(fastq_file_name, "rb") as f:
+        for first, last in _coalesce(starts, ends, max_gap, max_block_size):
+            block_start = starts[first]
+            f.seek(block_start)
+            block = f.read(ends[last - 1] - block_start)
+            n_read_calls += 1
+            for i in range(first, last):
+                yield read_ids[i], block[starts[i] - block_start:ends[i] - block_start]
+
+    logging.info("Fetched %d reads using %d read calls" % (len(read_ids), n_read_calls))
+
+
+def extract(fastq_file_name, read_ids, out_file, output_format="fastq", alignments=None, offsets=None):
+    from .numpy_alignments import decode_chromosome
+    if output_format == "bed" and alignments is None:
+        raise Exception("Alignments are needed to write bed")
+
+    n = 0
+    for read_id, record in get_records(fastq_file_name, read_ids, offsets):
+        if output_format == "fastq":
+            out_file.write(record)
+        elif output_format == "bed":
+            read_length = len(record.split(b"\n")[1].strip())
+            row = alignments.get_rows(read_id)
+            position = int(alignments.positions[row])
+            out_file.write(b"%s\t%d\t%d\t%d\n" % (decode_chromosome(alignments.chromosomes[row]).encode(),
+                                                 position, position + read_length, read_id))
+        else:
+            raise Exception("Invalid output format %s (must be fastq or bed)" % output_format)
+        n += 1
+
+    logging.info("Wrote %d reads" % n)
@@ -1,68 +1,189 @@
 import datetime
-from numpy.random import randint
-
-def make_report(directory, ids, names, colors):
-    out = """
-    <html>
-    <head>
-        <link rel="stylesheet" href="https://stackpath.bootstrapcdn.com/bootstrap/4.2.1/css/bootstrap.min.css" integrity="sha384-GJzZqFGwb1QTTN6wy59ffF1BuGJpLSa9DkKMp0DgiMDm4iYMj70gZWKYbI706tWS" crossorigin="anonymous">
-
-        <style>
-            .image_box{
-                display: table-cell;
-                padding: 0px;
-
-        </style>
-    </head>
-
-    <body>
-
-    <div style='width: 1800px;'>
-    """
-
-    images = [("All reads", "all"), ("Reads with variants", "variants"), ("Reads without variants", "nonvariants")]
-
-    header = "Report %s" % str(datetime.datetime.now())
-    out += "<div align='center' style='width: 1800px; font-size: 2em; font-weight: bold;'>" + header + "</div>"
-
-    directory = "./"
-    for title, image_postfix in images:
-        image_url = image_postfix + ".html?r=" + str(randint(0,9999999999))
-        width = 600
-        if "novel" in image_postfix:
-            width = 600
-
-        out += """<div class='image_box'>
-        <div align='center'><p style='font-size: 1.7em; position: relative; top: 100px;'><b>%s</b></p></div>
-        <iframe style='width: %dpx; height: %dpx; border: none;' src='%s'></iframe>
-        </div>
-        """ % (title, width, width, image_url)
-
-
-    out += "<div style='font-size: 1.5em; text-align: center; margin-top: -30px;'>"
+import html
+import json
+import math
+
+# The report is a single html file. Curves (see Comparer.compute_roc_curve) are embedded as json and drawn
+# with plotly.js, which is embedded once for all plots, or drawn as static svg (no javascript) with static=True.
+# Nothing is loaded from the network.
+
+PLOTS = [("All reads", "all"), ("Reads with variants", "variants"), ("Reads without variants", "nonvariants")]
+PLOT_SIZE = 600
+X_TITLE = "#wrong mapped / #mapped"
+Y_TITLE = "#correctly mapped / total"
+
+STYLE = """
+        body { font-family: sans-serif; }
+        .plot_box { display: inline-block; vertical-align: top; text-align: center; }
+        .plot_title { font-size: 1.7em; font-weight: bold; }
+        .legend { font-size: 1.5em; text-align: center; }
+        .legend span { margin-right: 30px; }
+"""
+
+PLOT_SCRIPT = """
+    var textPositions = ["top left", "bottom left"];
+    document.querySelectorAll("div[data-curves]").forEach(function (div) {
+        var curves = REPORT.curves[div.dataset.curves];
+        var traces = [];
+        REPORT.ids.forEach(function (id, i) {
+            var curve = curves[id];
+            var trace = {x: curve.one_minus_precision, y: curve.recall, name: REPORT.names[id],
+                         text: curve.mapqs.map(function (m) { return m % 10 == 0 ? m : null; }),
+                         mode: "markers+lines+text", textposition: textPositions[i % 2], textfont: {size: 16},
+                         marker: {size: 7, color: REPORT.colors[id]}};
+            if (curve.recall_low) {
+                // confidence interval of recall as a band, of 1 - precision as error bars
+                traces.push({x: curve.one_minus_precision.concat(curve.one_minus_precision.slice().reverse()),
+                             y: curve.recall_high.concat(curve.recall_low.slice().reverse()),
+                             fill: "toself", fillcolor: REPORT.colors[id], opacity: 0.2, line: {width: 0},
+                             mode: "lines", hoverinfo: "skip"});
+                trace.error_x = {type: "data", symmetric: false, color: REPORT.colors[id], thickness: 1, width: 0,
+                                 array: curve.one_minus_precision_high.map(function (h, j) { return h - curve.one_minus_precision[j]; }),
+                                 arrayminus: curve.one_minus_precision_low.map(function (l, j) { return curve.one_minus_precision[j] - l; })};
+            }
+            traces.push(trace);
+        });
+        var layout = {width: PLOT_SIZE, height: PLOT_SIZE, showlegend: false,
+                      xaxis: {type: "log", showgrid: true, zeroline: true, showexponent: "all", exponentformat: "e",
+                              nticks: 5, tickfont: {size: 16}, title: {text: "X_TITLE"}},
+                      yaxis: {tickfont: {size: 16}, title: {text: "Y_TITLE"}}};
+        Plotly.newPlot(div, traces, layout, {responsive: false});
+    });
+"""
+
+
+def _compact(values):
+    # 6 significant digits is plenty for plotting and keeps the embedded json small
+    return [float("%.6g" % v) if v is not None else None for v in values]
+
+
+INTERVAL_KEYS = ["recall_low", "recall_high", "one_minus_precision_low", "one_minus_precision_high"]
+
+
+def _compact_curve(curve):
+    compact = {"mapqs": curve["mapqs"], "recall": _compact(curve["recall"]),
+               "one_minus_precision": _compact(curve["one_minus_precision"])}
+    for key in INTERVAL_KEYS:
+        if key in curve:
+            compact[key] = _compact(curve[key])
+    return compact
+
+
+def _svg_plot(curves, ids, colors, size=PLOT_SIZE):
+    # Static rendering of curves with log scaled x axis
+    margin_left, margin_bottom, margin = 80, 70, 20
+    width = size - margin_left - margin
+    height = size - margin_bottom - margin
+
+    points = {}
     for id in ids:
-        color = colors[id]
-        out += "<span style='margin-right: 30px'><font color='" + color + "'>&#9644; " + names[id] + "</font></span>"
-
-    out += "</div>"
-
-    # Make a separate part for all reads
-    out += """
-    <div style='margin-top: 100px; margin-left: 50px;'>
-    <h2>All reads in separate plot</h2>
-    <iframe style='width: 600px; height: 600px; border: none; float: left;' src='all.html?r=""" + str(randint(0, 9999999999)) + """'></iframe>
-    <p style='margin-top: 100px;'>
-    """
+        curve = curves[id]
+        points[id] = [(x, y, mapq) for x, y, mapq in zip(curve["one_minus_precision"], curve["recall"], curve["mapqs"])
+                      if x is not None and y is not None and math.isfinite(x) and math.isfinite(y) and x > 0]
+
+    all_points = [p for id in ids for p in points[id]]
+    if len(all_points) == 0:
+        return "<svg width='%d' height='%d'><text x='%d' y='%d'>No data</text></svg>" % (size, size, size // 2, size // 2)
+
+    min_exponent = math.floor(math.log10(min(x for x, y, m in all_points)))
+    max_exponent = math.ceil(math.log10(max(x for x, y, m in all_points)))
+    max_exponent = max(max_exponent, min_exponent + 1)
+    min_y = min(y for x, y, m in all_points)
+    max_y = max(y for x, y, m in all_points)
+    if max_y - min_y < 1e-6:
+        min_y, max_y = min_y - 0.05, max_y + 0.05
+    padding = (max_y - min_y) * 0.05
+    min_y, max_y = min_y - padding, max_y + padding
+
+    def to_x(x):
+        return margin_left + width * (math.log10(x) - min_exponent) / (max_exponent - min_exponent)
+
+    def to_y(y):
+        return margin + height * (1 - (y - min_y) / (max_y - min_y))
+
+    out = ["<svg xmlns='http://www.w3.org/2000/svg' width='%d' height='%d' font-size='14'>" % (size, size)]
+    out.append("<rect x='%d' y='%d' width='%d' height='%d' fill='#e5ecf6'/>" % (margin_left, margin, width, height))
+
+    # grid and ticks
+    for exponent in range(min_exponent, max_exponent + 1):
+        x = to_x(10 ** exponent)
+        out.append("<line x1='%.1f' y1='%d' x2='%.1f' y2='%d' stroke='white'/>" % (x, margin, x, margin + height))
+        out.append("<text x='%.1f' y='%d' text-anchor='middle'>1e%d</text>" % (x, margin + height + 20, exponent))
+    for i in range(6):
+        y = min_y + (max_y - min_y) * i / 5
+        out.append("<line x1='%d' y1='%.1f' x2='%d' y2='%.1f' stroke='white'/>" % (margin_left, to_y(y), margin_left + width, to_y(y)))
+        out.append("<text x='%d' y='%.1f' text-anchor='end'>%.3g</text>" % (margin_left - 5, to_y(y) + 5, y))
+    out.append("<text x='%d' y='%d' text-anchor='middle'>%s</text>" % (margin_left + width // 2, size - 15, html.escape(X_TITLE)))
+    out.append("<text transform='translate(20 %d) rotate(-90)' text-anchor='middle'>%s</text>" % (margin + height // 2, html.escape(Y_TITLE)))
 
     for id in ids:
-        color = colors[id]
-        out += "<span style='margin-right: 30px; font-size: 1.5em;'><font color='" + color + "'>&#9644; " + names[id] + "</font></span><br>"
-
-    out += """
-    </div>
-    """
+        color = html.escape(colors[id], quote=True)
+        if "recall_low" in curves[id]:
+            # confidence interval of recall as a band, of 1 - precision as error bars
+            interval_points = [p for p in zip(*[curves[id][key] for key in ["one_minus_precision", "recall"] + INTERVAL_KEYS])
+                               if all(v is not None and math.isfinite(v) for v in p) and min(p[0], p[4]) > 0]
+            band = [(to_x(x), to_y(high)) for x, y, low, high, x_low, x_high in interval_points] + \
+                   [(to_x(x), to_y(low)) for x, y, low, high, x_low, x_high in reversed(interval_points)]
+            out.append("<polygon fill='%s' fill-opacity='0.2' points='%s'/>" % (color, " ".join("%.1f,%.1f" % p for p in band)))
+            for x, y, low, high, x_low, x_high in interval_points:
+                out.append("<line x1='%.1f' y1='%.1f' x2='%.1f' y2='%.1f' stroke='%s'/>" % (to_x(x_low), to_y(y), to_x(x_high), to_y(y), color))
+
+        coordinates = [(to_x(x), to_y(y), mapq) for x, y, mapq in points[id]]
+        out.append("<polyline fill='none' stroke='%s' stroke-width='2' points='%s'/>"
+                   % (color, " ".join("%.1f,%.1f" % (x, y) for x, y, mapq in coordinates)))
+        for x, y, mapq in coordinates:
+            out.append("<circle cx='%.1f' cy='%.1f' r='3.5' fill='%s'/>" % (x, y, color))
+            if mapq % 10 == 0:
+                out.append("<text x='%.1f' y='%.1f' text-anchor='end' fill='%s'>%d</text>" % (x - 5, y - 5, color, mapq))
+
+    out.append("</svg>")
+    return "\n".join(out)
+
+
+def _legend(ids, names, colors):
+    return "<div class='legend'>%s</div>" % "".join(
+        "<span style='color: %s'>&#9644; %s</span>" % (html.escape(colors[id], quote=True), html.escape(names[id]))
+        for id in ids)
+
+
+def make_report(curves, ids, names, colors, static=False):
+    # curves: {type: {id: curve}} for the types in PLOTS
+    def plot(type):
+        if static:
+            return _svg_plot(curves[type], ids, colors)
+        return "<div data-curves='%s'></div>" % type
+
+    out = ["<!DOCTYPE html>", "<html>", "<head>", "<meta charset='utf-8'>", "<style>%s</style>" % STYLE]
+    if not static:
+        from plotly.offline import get_plotlyjs
+        out.append("<script type='text/javascript'>%s</script>" % get_plotlyjs())
+    out.append("</head>")
+    out.append("<body>")
+
+    out.append("<div align='center' style='font-size: 2em; font-weight: bold;'>Report %s</div>" % str(datetime.datetime.now()))
+    out.append("<div style='white-space: nowrap;'>")
+    for title, type in PLOTS:
+        out.append("<div class='plot_box'><div class='plot_title'>%s</div>%s</div>" % (title, plot(type)))
+    out.append("</div>")
+    out.append(_legend(ids, names, colors))
 
-    out += """</div></body>
-    </html>"""
-
-    return out
+    # Make a separate part for all reads
+    out.append("<div style='margin-top: 100px; margin-left: 50px;'>")
+    out.append("<h2>All reads in separate plot</h2>")
+    out.append("<div class='plot_box'>%s</div>" % plot("all"))
+    out.append("<div class='plot_box' style='margin-top: 100px; text-align: left;'>%s</div>"
+               % "<br>".join("<span style='font-size: 1.5em; color: %s'>&#9644; %s</span>"
+                             % (html.escape(colors[id], quote=True), html.escape(names[id])) for id in ids))
+    out.append("</div>")
+
+    if not static:
+        data = {"ids": ids, "names": names, "colors": colors,
+                "curves": {type: {id: _compact_curve(curves[type][id]) for id in ids} for title, type in PLOTS}}
+        # json.dumps writes Infinity and NaN (for types without reads) which are valid in javascript
+        data = json.dumps(data, separators=(",", ":")).replace("</", "<\\/")
+        script = PLOT_SCRIPT.replace("PLOT_SIZE", str(PLOT_SIZE)).replace("X_TITLE", X_TITLE).replace("Y_TITLE", Y_TITLE)
+        out.append("<script type='text/javascript'>\n    var REPORT = %s;%s</script>" % (data, script))
+
+    out.append("</body>")
+    out.append("</html>")
+    return "\n".join(out)
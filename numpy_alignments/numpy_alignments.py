@@ -1,12 +1,14 @@
 import logging
 import numpy as np
 import sys
-from tqdm import tqdm
-import bionumpy as bnp
-from graph_read_simulator.simulation import MultiChromosomeCoordinateMap
-from shared_memory_wrapper import from_file, to_file
-from bionumpy.datatypes import BamEntry
-from bionumpy.bnpdataclass import bnpdataclass
+from .columns import PackedBoolArray, narrow_positions, widen_positions
+from .store import detect_format, find_file, provenance, read_store, store_file_name, write_store
+
+# sam flag bits
+FLAG_PAIRED = 0x1
+FLAG_PROPER_PAIR = 0x2
+FLAG_SECOND_MATE = 0x80
+FLAG_NOT_PRIMARY = 0x900  # secondary or supplementary alignment
 
 
 def encode_chromosome(chromosome):
@@ -26,6 +28,41 @@ def encode_chromosome(chromosome):
     return chromosome
 
 
+def decode_chromosome(chromosome):
+    chromosome = int(chromosome)
+    if chromosome == 23:
+        return "X"
+    elif chromosome == 24:
+        return "Y"
+    return str(chromosome)
+
+
+def contig_dictionary(chromosomes):
+    return {decode_chromosome(code): int(code) for code in np.unique(chromosomes)}
+
+
+def encode_contigs(names):
+    # Encodes a list of contig names with encode_chromosome. Contigs that encode_chromosome
+    # does not know get codes from 25 and up (sorted by name)
+    unique_names = sorted(set(names))
+    dictionary = {}
+    unknown = []
+    for name in unique_names:
+        try:
+            dictionary[name] = encode_chromosome(name)
+        except ValueError:
+            unknown.append(name)
+
+    if len(unknown) > 0:
+        logging.warning("%d contigs are not numbered chromosomes. These are numbered from 25 and up in sorted order, "
+                        "which is only consistent between files with the same such contigs" % len(unknown))
+        dictionary.update({name: 25 + i for i, name in enumerate(unknown)})
+
+    dtype = np.uint8 if max(dictionary.values(), default=0) < 256 else np.uint16
+    codes = np.array([dictionary[name] for name in names], dtype=dtype)
+    return codes, dictionary
+
+
 def name_to_id(name):
     if "/" in name:
         name = name.split("/")
@@ -37,46 +74,144 @@ def name_to_id(name):
 
 
 class NumpyAlignments:
-    def __init__(self, chromosomes, positions, n_variants, scores, mapqs, is_correct=None):
+    def __init__(self, chromosomes, positions, n_variants, scores, mapqs, is_correct=None, read_ids=None, flags=None,
+                 narrow=True):
         self.chromosomes = chromosomes
-        self.positions = positions
-        self.scores = scores
+        # positions of stores are used as they are (the dtype was chosen when writing)
+        self.positions = narrow_positions(positions) if narrow else positions
+        self.scores = scores  # None if the input has no scores
         self.mapqs = mapqs
         self.n_variants = n_variants
-        self.is_correct = is_correct # indexes of correct alignments
+        self.is_correct = is_correct
+        self.read_ids = read_ids  # read id of each row for subsampled alignments, None means row i is read i
+        self.flags = flags  # sam flags (None if the input has no flags)
+        self.region_index = None  # RegionIndex, if stored
+        # header fields of the store (sort order, contigs, provenance, ...)
+        self.metadata = {"sort_order": "read_id"}
+
+    # is_correct and n_variants are only used as booleans (n_variants > 0), and are stored bit-packed
+    @property
+    def is_correct(self):
+        return self._is_correct
+
+    @is_correct.setter
+    def is_correct(self, is_correct):
+        if is_correct is not None and not isinstance(is_correct, PackedBoolArray):
+            is_correct = PackedBoolArray.from_array(is_correct)
+        self._is_correct = is_correct
 
+    @property
+    def n_variants(self):
+        return self._has_variants
+
+    @n_variants.setter
+    def n_variants(self, n_variants):
+        if n_variants is not None and not isinstance(n_variants, PackedBoolArray):
+            n_variants = PackedBoolArray.from_array(n_variants)
+        self._has_variants = n_variants
+
+    def correct_mask(self):
+        return self.is_correct.to_array()
+
+    def variants_mask(self):
+        if self.n_variants is None:
+            # no variant information (e.g. from bed), same as no reads having variants
+            return np.zeros(len(self.positions), dtype=bool)
+        return self.n_variants.to_array()
+
+    def count_correct(self, selection=None):
+        if selection is None:
+            return self.is_correct.count_nonzero()
+        return np.count_nonzero(self.is_correct[selection])
 
     def __getitem__(self, item):
         data = {
             "chromosome": self.chromosomes[item],
             "position": self.positions[item],
-            "score": self.scores[item],
+            "score": self.scores[item] if self.scores is not None else None,
             "mapq": self.mapqs[item],
-            "n_variants": self.n_variants[item],
+            "n_variants": self.n_variants[item] if self.n_variants is not None else None,
             "is_correct": self.is_correct[item] if self.is_correct is not None and len(self.is_correct) > 0 else None,
         }
         return data
 
+    def get_read_ids(self, rows):
+        if self.read_ids is None:
+            return np.asarray(rows)
+        return np.asarray(self.read_ids)[rows]
+
+    def get_rows(self, read_ids):
+        # Rows of the given read ids (the inverse of get_read_ids)
+        if self.read_ids is None:
+            return read_ids
+        rows = np.minimum(np.searchsorted(self.read_ids, read_ids), len(self.read_ids) - 1)
+        if not np.all(np.asarray(self.read_ids)[rows] == read_ids):
+            raise Exception("Some reads are not in the sample of the alignments")
+        return rows
+
+    def get_region_index(self):
+        if self.region_index is None:
+            from .region_index import RegionIndex
+            logging.warning("Alignments have no region index. Building one (store truth alignments with an index to avoid this)")
+            self.region_index = RegionIndex.from_alignments(self.chromosomes, self.positions)
+        return self.region_index
+
+    def take_reads(self, read_ids):
+        # Alignments of only the given (sorted) read ids. Columns are only read at the rows of these reads
+        rows = self.get_rows(read_ids)
+        take = lambda column: column[rows] if column is not None else None
+        alignments = NumpyAlignments(take(self.chromosomes), take(self.positions), take(self.n_variants), take(self.scores),
+                                     take(self.mapqs), take(self.is_correct), read_ids=np.asarray(read_ids),
+                                     flags=take(self.flags))
+        alignments.metadata = dict(self.metadata)
+        return alignments
+
+    def subsample(self, fraction, seed=0):
+        # Alignments of the reads in the hash based sample with this fraction (see sampling.py). Columns are taken
+        # only at the sampled rows, so memory mapped columns are not read in full
+        from .sampling import sample_mask, sampling_metadata
+        sampling = self.metadata.get("sampling")
+        if sampling is not None:
+            if sampling["seed"] != seed or fraction > sampling["fraction"]:
+                raise Exception("Alignments are sampled with fraction %s and seed %s, cannot sample fraction %s with seed %s"
+                                % (sampling["fraction"], sampling["seed"], fraction, seed))
+            if fraction == sampling["fraction"]:
+                return self
+
+        read_ids = self.get_read_ids(np.arange(len(self.positions)))
+        sample = self.take_reads(read_ids[sample_mask(read_ids, fraction, seed)])
+        sample.metadata["sampling"] = sampling_metadata(fraction, seed)
+        logging.info("Sampled %d of %d alignments" % (len(sample.positions), len(self.positions)))
+        return sample
+
+    def check_comparable(self, other):
+        if self.metadata.get("sort_order") != other.metadata.get("sort_order"):
+            raise Exception("Cannot compare alignments sorted by %s with alignments sorted by %s"
+                            % (self.metadata.get("sort_order"), other.metadata.get("sort_order")))
+
+        if self.metadata.get("sampling") != other.metadata.get("sampling"):
+            raise Exception("Cannot compare alignments with different sampling (%s and %s)"
+                            % (self.metadata.get("sampling"), other.metadata.get("sampling")))
+
+        contigs = self.metadata.get("contigs", {})
+        other_contigs = other.metadata.get("contigs", {})
+        different = [name for name in contigs if name in other_contigs and contigs[name] != other_contigs[name]]
+        if len(different) > 0:
+            logging.warning("Contigs %s are encoded differently in the two alignment sets. Alignments to these are "
+                            "not compared correctly" % ",".join(different))
+
     def set_correctness(self, truth_alignments, force=False, allowed_mismatch=150):
         if not force and self.is_correct is not None and len(self.is_correct) == len(self.positions):
             logging.info("Not setting correctness. Is set before")
             return
 
+        self.check_comparable(truth_alignments)
         logging.info("Allowing %d base pairs mismatch" % allowed_mismatch)
         # Sets which alignments are correctly align by checking against another alignment set
-        self.is_correct = np.zeros(len(self.chromosomes), dtype=np.uint8)
         self.n_variants = truth_alignments.n_variants
-        #chromosome_match = set(np.where(self.chromosomes == truth_alignments.chromosomes)[0])
-        #position_match = set(np.where(np.abs(self.positions - truth_alignments.positions) <= allowed_mismatch)[0])
-        #match = np.array(list(chromosome_match.intersection(position_match)))
-
-        match = np.where((self.chromosomes == truth_alignments.chromosomes) & (np.abs(self.positions - truth_alignments.positions) <= allowed_mismatch))[0]
-
-        logging.info("Number of matches: %d" % len(match))
-        self.is_correct[match] = 1
-        logging.info("N correct: %d" % len(match))
-        #self.is_correct[np.where((self.chromosomes == truth_alignments.chromosomes) &
-        # (np.abs(self.positions - truth_alignments.positions) <= allowed_mismatch))[0]] = 1
+        match = (self.chromosomes == truth_alignments.chromosomes) & (np.abs(self.positions - truth_alignments.positions) <= allowed_mismatch)
+        self.is_correct = match
+        logging.info("N correct: %d" % self.is_correct.count_nonzero())
 
     @classmethod
     def from_sam(cls, n_alignments):
@@ -86,10 +221,13 @@ class NumpyAlignments:
         n_variants = np.zeros(n_alignments, dtype=np.uint8)
         scores = np.zeros(n_alignments, dtype=np.uint16)
         mapqs = np.zeros(n_alignments, dtype=np.uint8)
+        flags = np.zeros(n_alignments, dtype=np.uint16)
 
         is_paired_end = False
+        paired = False  # any read with flag 0x1 or a /1 or /2 name
 
         i = 0
+        from tqdm import tqdm
         for line in tqdm(sys.stdin, total=n_alignments):
             if line.startswith("@"):
                 continue
@@ -100,24 +238,17 @@ class NumpyAlignments:
                 logging.error(line)
                 continue
 
-            if int(l[1]) >= 256:
-                continue  # not primary mapping
+            flag = int(l[1])
+            if flag & FLAG_NOT_PRIMARY:
+                continue  # secondary or supplementary alignment
+            paired = paired or (flag & FLAG_PAIRED) != 0 or "/" in l[0]
 
-            if l[6] != "*":
+            if flag & FLAG_PAIRED and "/" not in l[0]:
+                # the aligner has removed /1 and /2 from the read name, the mate is given by the flag
                 if not is_paired_end:
-                    logging.info("Assuming sam is paired end. Will assign IDs automatically based on line number")
+                    logging.info("Sam is paired end. Read ids are read name * 2 + 0 for first and 1 for second mate")
                 is_paired_end = True
-
-            if is_paired_end:
-                # hacky, should be fixed
-                if "/" in l[0]:
-                    identifier = name_to_id(l[0])
-                else:
-                    # this is the id after mapping without the /
-                    identifier = name_to_id(l[0])*2
-                    flag = int(l[1])
-                    if flag >= 128:  # second in pair
-                        identifier += 1
+                identifier = name_to_id(l[0]) * 2 + (1 if flag & FLAG_SECOND_MATE else 0)
             else:
                 identifier = name_to_id(l[0])
 
@@ -140,11 +271,13 @@ class NumpyAlignments:
 
             position = int(l[3])
 
+            positions = widen_positions(positions, position)
             try:
                 chromosomes[identifier] = chromosome
                 positions[identifier] = position
                 scores[identifier] = score
                 mapqs[identifier] = int(l[4])
+                flags[identifier] = flag
             except IndexError:
                 logging.error("Got indexerror when parsing line. Skipping")
                 logging.error(line)
@@ -158,163 +291,117 @@ class NumpyAlignments:
             i += 1
 
         logging.info("Done getting alignments")
-        return cls(chromosomes, positions, n_variants, scores, mapqs)
+        alignments = cls(chromosomes, positions, n_variants, scores, mapqs, flags=flags)
+        if paired:
+            alignments.metadata["paired"] = True
+        return alignments
 
 
     @classmethod
-    def from_bed(cls, n_alignments):
-        chromosomes = np.zeros(n_alignments, dtype=np.uint8)
-        positions = np.zeros(n_alignments, dtype=np.int32)
-        n_variants = np.zeros(n_alignments, dtype=np.uint8)
-        scores = np.zeros(n_alignments, dtype=np.uint16)
-        mapqs = np.zeros(n_alignments, dtype=np.uint8)
-
-        for line in tqdm(sys.stdin, total=n_alignments):
-
-            l = line.split()
-            try:
-                identifier = name_to_id(l[3])
-            except IndexError:
-                logging.error("Cannot parse line %s" % line)
-                raise
-                sys.exit()
-
-            chromosome = encode_chromosome(l[0])
-
-            position = int(l[1])
-            chromosomes[identifier] = chromosome
-            positions[identifier] = position
-
-        return cls(chromosomes, positions, n_variants, scores, mapqs)
+    def _from_text(cls, format_name, n_alignments, input_file=None):
+        from .parsing import read_columns
+        if input_file is None:
+            input_file = sys.stdin.buffer
+        columns, paired = read_columns(input_file, format_name, n_alignments)
+        mapqs = columns.get("mapqs", np.zeros(n_alignments, dtype=np.uint8))
+        alignments = cls(columns["chromosomes"], columns["positions"], columns.get("n_variants"), columns.get("scores"), mapqs)
+        if paired:
+            alignments.metadata["paired"] = True
+        return alignments
 
     @classmethod
-    def from_truth(cls, n_alignments):
-        chromosomes = np.zeros(n_alignments, dtype=np.uint8)
-        positions = np.zeros(n_alignments, dtype=np.int32)
-        n_variants = np.zeros(n_alignments, dtype=np.uint8)
-        scores = np.zeros(n_alignments, dtype=np.uint16)
-        mapqs = np.zeros(n_alignments, dtype=np.uint8)
-
-        for line in tqdm(sys.stdin, total=n_alignments):
-
-            l = line.split()
-            try:
-                identifier = name_to_id(l[0])
-            except IndexError:
-                logging.error("Cannot parse line %s" % line)
-                raise
-                sys.exit()
-
-            chromosome = encode_chromosome(l[1])
-
-            position = int(l[2])
-            if len(l) > 7:
-                variants = int(l[7])
-            else:
-                variants = 0
-
-            chromosomes[identifier] = chromosome
-            positions[identifier] = position
-            n_variants[identifier] = variants
-
-        return cls(chromosomes, positions, n_variants, scores, mapqs)
+    def from_bed(cls, n_alignments, input_file=None):
+        return cls._from_text("bed", n_alignments, input_file)
 
     @classmethod
-    def from_vgpos(cls, n_alignments):
-        chromosomes = np.zeros(n_alignments, dtype=np.uint8)
-        positions = np.zeros(n_alignments, dtype=np.int32)
-        n_variants = np.zeros(n_alignments, dtype=np.uint8)
-        scores = np.zeros(n_alignments, dtype=np.uint16)
-        mapqs = np.zeros(n_alignments, dtype=np.uint8)
-
-        for i, line in enumerate(tqdm(sys.stdin, total=n_alignments)):
-
-            l = line.split()
-            identifier = i
-            chromosome = l[2]
-            if chromosome == "X":
-                chromosome = 23
-            elif chromosome == "Y":
-                chromosome = 24
-            elif chromosome == "null":
-                chromosome = 0
-            else:
-                try:
-                    chromosome = int(chromosome)
-                except ValueError:
-                    logging.error("Could not parse chromosome %s. Setting to 0" % (chromosome))
-                    chromosome = 0
-
-            if l[3] == "null":
-                position = 0
-            else:
-                position = int(l[3])
-
-            chromosomes[identifier] = chromosome
-            positions[identifier] = position
-
-        return cls(chromosomes, positions, n_variants, scores, mapqs)
+    def from_truth(cls, n_alignments, input_file=None):
+        return cls._from_text("truth", n_alignments, input_file)
 
     @classmethod
-    def from_pos(cls, n_alignments):
-        chromosomes = np.zeros(n_alignments, dtype=np.uint8)
-        positions = np.zeros(n_alignments, dtype=np.int32)
-        n_variants = np.zeros(n_alignments, dtype=np.uint8)
-        scores = np.zeros(n_alignments, dtype=np.uint16)
-        mapqs = np.zeros(n_alignments, dtype=np.uint8)
-
-        for line in tqdm(sys.stdin, total=n_alignments):
-
-            l = line.split()
-            identifier = name_to_id(l[0])
-            chromosome = l[1]
-            if chromosome == "X":
-                chromosome = 23
-            elif chromosome == "Y":
-                chromosome = 24
-            elif chromosome == "null":
-                chromosome = 0
-            else:
-                chromosome = int(chromosome)
-
-            if l[2] == "null":
-                position = 0
-            else:
-                position = int(l[2])
+    def from_vgpos(cls, n_alignments, input_file=None):
+        return cls._from_text("vgpos", n_alignments, input_file)
 
-            chromosomes[identifier] = chromosome
-            positions[identifier] = position
-            try:
-                mapqs[identifier] = int(l[3])
-                scores[identifier] = int(l[4])
-            except IndexError:
-                logging.warning("Could not get mapq or score on line %s" % line)
-
-        return cls(chromosomes, positions, n_variants, scores, mapqs)
+    @classmethod
+    def from_pos(cls, n_alignments, input_file=None):
+        return cls._from_text("pos", n_alignments, input_file)
+
+    def _columns(self):
+        columns = dict(chromosomes=self.chromosomes, positions=self.positions, mapqs=self.mapqs)
+        if self.scores is not None:
+            columns["scores"] = self.scores
+        if self.flags is not None:
+            columns["flags"] = self.flags
+        if self.n_variants is not None:
+            columns["n_variants"] = self.n_variants
+        if self.is_correct is not None:
+            columns["is_correct"] = self.is_correct
+        if self.read_ids is not None:
+            columns["read_ids"] = self.read_ids
+        if self.region_index is not None:
+            columns.update(self.region_index.columns())
+        return columns
 
     def to_file(self, file_name):
+        file_name = store_file_name(file_name)
         logging.info("Saving to file %s" % file_name)
-        np.savez(file_name,
-                chromosomes=self.chromosomes,
-                positions=self.positions,
-                scores=self.scores,
-                mapqs=self.mapqs,
-                n_variants=self.n_variants,
-                is_correct=self.is_correct if self.is_correct is not None else np.array([]))
+        columns = self._columns()
+        header = dict(self.metadata)
+        header["class"] = type(self).__name__
+        if "contigs" not in header:
+            header["contigs"] = contig_dictionary(columns["chromosomes"])
+        header["provenance"] = self.metadata.get("provenance", []) + [provenance()]
+        if getattr(self, "region_index", None) is not None:
+            header["region_index"] = self.region_index.header()
+        write_store(file_name, columns, header)
         logging.info("Saved to %s" % file_name)
 
     @classmethod
     def from_file(cls, file_name):
-        try:
-            data = np.load(file_name)
-        except FileNotFoundError:
-            data = np.load(file_name + ".npz")
+        # Loads any alignments file, dispatching on the class recorded in the header
+        file_name = find_file(file_name)
+        file_format = detect_format(file_name)
+        if file_format == "npz":
+            logging.warning("%s has an old file format. Convert it with numpy_alignments convert to load it faster" % file_name)
+            return NumpyAlignments._from_npz(file_name)
+        elif file_format == "shared_memory_wrapper":
+            logging.warning("%s has an old file format. Convert it with numpy_alignments convert to load it faster" % file_name)
+            return NumpyAlignments2.from_legacy_file(file_name)
+
+        header, columns = read_store(file_name)
+        return STORE_CLASSES[header["class"]]._from_store(header, columns)
+
+    @classmethod
+    def _from_store(cls, header, columns):
+        alignments = cls(columns["chromosomes"], columns["positions"], columns.get("n_variants"), columns.get("scores"),
+                         columns["mapqs"], columns.get("is_correct"), columns.get("read_ids"), columns.get("flags"),
+                         narrow=False)
+        alignments.metadata = {key: value for key, value in header.items()
+                               if key not in ("class", "format_version", "n_alignments", "columns", "region_index")}
+        if "region_index" in header:
+            from .region_index import RegionIndex
+            alignments.region_index = RegionIndex(columns["region_index_order"], columns["region_index_positions"],
+                                                  header["region_index"])
+        return alignments
+
+    @classmethod
+    def _from_npz(cls, file_name):
+        data = np.load(file_name)
+        n_alignments = len(data["positions"])
+        # older files have is_correct and n_variants as one uint8 per alignment
+        n_variants = None
+        if "n_variants_packed" in data:
+            n_variants = PackedBoolArray(data["n_variants_packed"], n_alignments)
+        elif "n_variants" in data:
+            n_variants = data["n_variants"]
 
         is_correct = None
-        if "is_correct" in data:
+        if "is_correct_packed" in data:
+            is_correct = PackedBoolArray(data["is_correct_packed"], n_alignments)
+        elif "is_correct" in data and len(data["is_correct"]) > 0:
             is_correct = data["is_correct"]
 
-        return cls(data["chromosomes"], data["positions"].astype(np.int32), data["n_variants"], data["scores"], data["mapqs"], is_correct)
+        scores = data["scores"] if "scores" in data else None
+        return cls(data["chromosomes"], data["positions"], n_variants, scores, data["mapqs"], is_correct)
 
     def compare(self, other):
         pass
@@ -324,10 +411,24 @@ class NumpyAlignments:
 # enables comparisons of alignments from different sources since these will be
 # sorted in the same way (e.g. some sources will omitt paired-end information)
 
-@bnpdataclass
-class CustomBamEntry(BamEntry):
-    base_name: bnp.encodings.BaseEncoding
-    pair_id: int
+# bionumpy is slow to import, so the dataclass is created the first time it is needed
+_custom_bam_entry = None
+
+
+def get_custom_bam_entry():
+    global _custom_bam_entry
+    if _custom_bam_entry is None:
+        import bionumpy as bnp
+        from bionumpy.datatypes import BamEntry
+        from bionumpy.bnpdataclass import bnpdataclass
+
+        @bnpdataclass
+        class CustomBamEntry(BamEntry):
+            base_name: bnp.encodings.BaseEncoding
+            pair_id: int
+
+        _custom_bam_entry = CustomBamEntry
+    return _custom_bam_entry
 
 
 # Tmp class that will replace NumpyAlignments
@@ -336,6 +437,9 @@ class NumpyAlignments2(NumpyAlignments):
         self.data = data
         self.n_variants = n_variants
         self.is_correct = None
+        self.read_ids = None  # rows are sorted by base name and pair id
+        self.region_index = None
+        self.metadata = {"sort_order": "base_name,pair_id"}
 
         self._is_preprocessed = is_preprocessed
         if self._is_preprocessed:
@@ -344,28 +448,55 @@ class NumpyAlignments2(NumpyAlignments):
 
     @classmethod
     def from_bam(cls, bam_file_name):
+        import bionumpy as bnp
         data = bnp.open(bam_file_name).read()
         logging.info("%d alignments in bam" % len(data))
-        data = data[data.flag < 256]  # remove seconday alignments
-        logging.info("%d alignments after removing secondary alignments" % len(data))
+        data = data[(data.flag & FLAG_NOT_PRIMARY) == 0]  # remove secondary and supplementary alignments
+        logging.info("%d alignments after removing secondary and supplementary alignments" % len(data))
         return cls(data)
 
     @classmethod
     def from_bam_and_nvariants_txt(cls, bam_file_name, nvariants_file_name):
+        import bionumpy as bnp
         data = bnp.open(bam_file_name).read()
         logging.info("%d alignments in bam" % len(data))
-        data = data[data.flag < 256]  # remove seconday alignments
-        logging.info("%d alignments after removing secondary alignments" % len(data))
-        n_variants = np.array([int(line.strip()) for line in open(nvariants_file_name)])
+        data = data[(data.flag & FLAG_NOT_PRIMARY) == 0]  # remove secondary and supplementary alignments
+        logging.info("%d alignments after removing secondary and supplementary alignments" % len(data))
+        n_variants = np.loadtxt(nvariants_file_name, dtype=np.int64, ndmin=1)
         return cls(data, n_variants)
 
-    def to_file(self, file_name):
-        return to_file([self.data.shallow_tuple(), self.n_variants], file_name)
+    def _columns(self):
+        chromosomes, contigs = encode_contigs(self.data.chromosome.tolist())
+        self.metadata["contigs"] = contigs
+        columns = dict(chromosomes=chromosomes, positions=narrow_positions(self.positions), mapqs=np.asarray(self.mapqs, dtype=np.uint8),
+                       flags=np.asarray(self.flags, dtype=np.uint16))
+        if np.any(columns["flags"] & FLAG_PAIRED):
+            self.metadata["paired"] = True
+        if self.n_variants is not None:
+            columns["n_variants"] = self.n_variants
+        if self.is_correct is not None:
+            columns["is_correct"] = self.is_correct
+        if self.read_ids is not None:
+            columns["read_ids"] = self.read_ids
+        if self.region_index is not None:
+            columns.update(self.region_index.columns())
+        return columns
 
     @classmethod
-    def from_file(cls, file_name):
+    def _from_store(cls, header, columns):
+        # Only the columns are stored, so these are loaded as NumpyAlignments (sorted by base name and pair id)
+        return NumpyAlignments._from_store(header, columns)
+
+    def get_read_ids(self, rows):
+        # rows are sorted by base name and pair id, there are no numeric read ids
+        return np.asarray(rows)
+
+    @classmethod
+    def from_legacy_file(cls, file_name):
+        # files written with shared_memory_wrapper before the store format
+        from shared_memory_wrapper import from_file
         data, n_variants = from_file(file_name)
-        return cls(CustomBamEntry(*data), n_variants, is_preprocessed=True)
+        return cls(get_custom_bam_entry()(*data), n_variants, is_preprocessed=True)
 
     def preprocess(self):
 
@@ -373,13 +504,12 @@ class NumpyAlignments2(NumpyAlignments):
         # add base_name field with base_name (not including paired-end information if available)
         base_names = [str(name).split("/")[0] for name in self.data.name]
 
-        # add pair-id (0 or 1)
-        binary_flags = [bin(flag)[2:] for flag in self.data.flag]
-        pair_ids = [0 if len(flag) < 8 or flag[-8] == 0 else 1 for flag in binary_flags]
+        # add pair-id (0 or 1, 1 for the second mate)
+        pair_ids = ((np.asarray(self.data.flag) & FLAG_SECOND_MATE) != 0).astype(int)
         #new_data = self.data.add_fields({"base_name": base_names, "pair_id": pair_ids},
         #                                {"base_name": bnp.encodings.BaseEncoding, "pair_id": int})
         fields = self.data.shallow_tuple()
-        new_data = CustomBamEntry(*self.data.shallow_tuple(), base_names, pair_ids)
+        new_data = get_custom_bam_entry()(*self.data.shallow_tuple(), base_names, pair_ids)
 
         # sort alignments on base name and pair-id
         # after this sorting, these alignments can be compared to any bam with the same alignments
@@ -404,6 +534,10 @@ class NumpyAlignments2(NumpyAlignments):
     def mapqs(self):
         return self.data.mapq
 
+    @property
+    def flags(self):
+        return self.data.flag
+
     @property
     def scores(self):
         return NotImplemented
@@ -415,13 +549,14 @@ class NumpyAlignments2(NumpyAlignments):
             return
 
         logging.info("Allowing %d base pairs mismatch" % allowed_mismatch)
-        self.is_correct = np.zeros(len(self.chromosomes), dtype=np.uint8)
         self.n_variants = truth_alignments.n_variants
 
+        import bionumpy as bnp
         chromosome_match = bnp.str_equal(self.chromosomes, truth_alignments.chromosomes)
         position_match = np.abs(self.positions - truth_alignments.positions) <= allowed_mismatch
-        match = np.where(chromosome_match & position_match)[0]
+        self.is_correct = chromosome_match & position_match
+        logging.info("N correct: %d" % self.is_correct.count_nonzero())
+
 
-        logging.info("Number of matches: %d" % len(match))
-        self.is_correct[match] = 1
-        logging.info("N correct: %d" % len(match))
+# classes that can be recorded in the header of a store
+STORE_CLASSES = {"NumpyAlignments": NumpyAlignments, "NumpyAlignments2": NumpyAlignments2}
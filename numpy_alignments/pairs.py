@@ -0,0 +1,67 @@
+import logging
+import numpy as np
+from .numpy_alignments import FLAG_PROPER_PAIR
+
+# Paired-end reads have read ids 2k (first mate) and 2k + 1 (second mate) (see name_to_id and from_sam), so
+# the mates of all pairs are the even and odd rows. Pair metrics are computed on these two strided views.
+
+MAX_FRAGMENT_LENGTH = 1000
+
+
+def mate_rows(alignments):
+    # Returns (rows of first mates, rows of second mates). Slices when row i is read i, otherwise the rows of the
+    # pairs that have both mates (e.g. in a region)
+    read_ids = getattr(alignments, "read_ids", None)
+    if read_ids is None:
+        n_pairs = len(alignments.positions) // 2
+        return slice(0, 2 * n_pairs, 2), slice(1, 2 * n_pairs, 2)
+
+    read_ids = np.asarray(read_ids)
+    first = np.flatnonzero((read_ids[:-1] % 2 == 0) & (read_ids[1:] == read_ids[:-1] + 1))
+    if 2 * len(first) < len(read_ids):
+        logging.info("Using %d complete pairs of %d reads" % (len(first), len(read_ids)))
+    return first, first + 1
+
+
+def n_correct_mates(alignments):
+    # Number of correctly aligned mates (0, 1 or 2) for each pair. set_correctness must be called first
+    first, second = mate_rows(alignments)
+    correct = alignments.correct_mask()
+    return correct[first].astype(np.uint8) + correct[second]
+
+
+def discordant_pairs(alignments, max_fragment_length=MAX_FRAGMENT_LENGTH):
+    # Pairs with mates aligned to different chromosomes or further apart than max_fragment_length
+    first, second = mate_rows(alignments)
+    chromosomes = np.asarray(alignments.chromosomes)
+    positions = np.asarray(alignments.positions, dtype=np.int64)
+    return (chromosomes[first] != chromosomes[second]) | (np.abs(positions[first] - positions[second]) > max_fragment_length)
+
+
+def proper_pairs(alignments):
+    # Pairs that the aligner flagged as properly paired (None if there are no flags)
+    if getattr(alignments, "flags", None) is None:
+        return None
+    first, second = mate_rows(alignments)
+    flags = np.asarray(alignments.flags)
+    return ((flags[first] & FLAG_PROPER_PAIR) != 0) & ((flags[second] & FLAG_PROPER_PAIR) != 0)
+
+
+def pair_metrics(alignments, max_fragment_length=MAX_FRAGMENT_LENGTH):
+    # Counts of pairs by number of correct mates, discordant pairs, and (if flags are stored) the number of proper
+    # pairs by number of correct mates (index 0, 1, 2)
+    n_correct = n_correct_mates(alignments)
+    counts = np.bincount(n_correct, minlength=3)
+    discordant = discordant_pairs(alignments, max_fragment_length)
+    metrics = {"n_pairs": len(n_correct),
+               "both_correct": int(counts[2]),
+               "one_correct": int(counts[1]),
+               "none_correct": int(counts[0]),
+               "discordant": int(np.count_nonzero(discordant)),
+               "n_pairs_by_n_correct": counts,
+               "discordant_by_n_correct": np.bincount(n_correct[discordant], minlength=3)}
+
+    proper = proper_pairs(alignments)
+    if proper is not None:
+        metrics["proper_pairs_by_n_correct"] = np.bincount(n_correct[proper], minlength=3)
+    return metrics
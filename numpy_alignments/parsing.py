@@ -0,0 +1,422 @@
+import logging
+import numpy as np
+from .columns import INT32_MAX, INT32_MIN
+
+# Vectorized parsing of whitespace delimited text formats (pos, truth, bed, vgpos). Each format is a list of
+# Columns, and the input is parsed in large chunks of whole lines directly from bytes to integer columns.
+
+
+class Column:
+    # kind is one of
+    #   int: integer field, "null" gives default
+    #   chromosome: chromosome name, encoded with encode_chromosome ("null" gives default)
+    #   read_id: read name encoded with name_to_id (123 or 123/1)
+    #   line_number: not a field, the line number in the input (used as read id)
+    def __init__(self, name, field, kind="int", dtype=np.int64, default=0, optional=False):
+        self.name = name
+        self.field = field
+        self.kind = kind
+        self.dtype = dtype
+        self.default = default
+        self.optional = optional
+
+
+FORMATS = {
+    "pos": [Column("read_ids", 0, "read_id"),
+            Column("chromosomes", 1, "chromosome", np.uint8),
+            Column("positions", 2, "int", np.int32),
+            Column("mapqs", 3, "int", np.uint8, optional=True),
+            Column("scores", 4, "int", np.uint16, optional=True)],
+    "truth": [Column("read_ids", 0, "read_id"),
+              Column("chromosomes", 1, "chromosome", np.uint8),
+              Column("positions", 2, "int", np.int32),
+              Column("n_variants", 7, "int", np.uint8, optional=True)],
+    "bed": [Column("chromosomes", 0, "chromosome", np.uint8),
+            Column("positions", 1, "int", np.int32),
+            Column("read_ids", 3, "read_id")],
+    "vgpos": [Column("read_ids", None, "line_number"),
+              Column("chromosomes", 2, "chromosome", np.uint8),
+              Column("positions", 3, "int", np.int32)],
+}
+
+# Bytes up to and including space (space, tab, newline, carriage return and other control characters) separate tokens
+_SPACE = ord(" ")
+# Chunks are padded with spaces so that the 8 bytes before and after any position can be loaded as one uint64
+_PADDING = 8
+_PADDING_BYTES = b" " * _PADDING
+_ZEROS = np.uint64(0x3030303030303030)  # eight "0" characters
+_ABOVE_NINE = np.uint64(0x7676767676767676)  # added to a digit minus "0" sets the high bit of bytes above "9"
+_HIGH_BITS = np.uint64(0x8080808080808080)
+# _TOKEN_MASKS[n] selects the last n bytes of a uint64 loaded from memory (the high bytes, little-endian) and
+# _KEY_MASKS[n] the first n bytes
+_TOKEN_MASKS = np.array([0] + [(2**64 - 1) ^ (2**(8 * (8 - n)) - 1) for n in range(1, 9)], dtype=np.uint64)
+_KEY_MASKS = np.array([2**(8 * n) - 1 for n in range(9)], dtype=np.uint64)
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+# Chunks are small enough that the arrays of a chunk (a few per token of a field) stay in the cpu cache
+CHUNK_SIZE = 512 * 1024
+LOG_INTERVAL = 1000000  # lines
+
+
+def read_chunks(input_file, chunk_size=CHUNK_SIZE, count_lines=True):
+    # Yields (chunk, line number of first line in chunk), where chunk is bytes of whole lines padded with
+    # _PADDING spaces on both sides (as parse_chunk wants them, padding here saves copying every chunk again).
+    # The line number is None if count_lines is False (only the vgpos format uses line numbers)
+    remainder = b""
+    line_number = 0
+    while True:
+        data = input_file.read(chunk_size)
+        if len(data) == 0:
+            break
+        last_newline = data.rfind(b"\n")
+        if last_newline == -1:
+            remainder += data
+            continue
+        chunk = b"".join([_PADDING_BYTES, remainder, memoryview(data)[:last_newline + 1], _PADDING_BYTES])
+        remainder = data[last_newline + 1:]
+        yield chunk, line_number if count_lines else None
+        if count_lines:
+            line_number += chunk.count(b"\n")
+
+    if len(remainder) > 0:
+        yield b"".join([_PADDING_BYTES, remainder, b"\n", _PADDING_BYTES]), line_number if count_lines else None
+
+
+class _Tokens:
+    # Start and end of the tokens on each line of a chunk. When all lines have the same number of tokens separated
+    # by single whitespace characters (the usual case), the separators are the tokens ends of an (n_lines, n_tokens)
+    # matrix, and the tokens of a field are found with one column of it. Otherwise the tokens of every line are
+    # found with a binary search of the line ends.
+    def __init__(self, buffer, n_lines):
+        self.n_lines = n_lines
+        is_space = buffer <= _SPACE
+        separators = np.flatnonzero(is_space)
+        n_tokens = len(separators) // max(n_lines, 1)
+        self._separators = None
+        self._columns = {}
+        if n_lines > 0 and n_tokens > 0 and len(separators) == n_lines * n_tokens:
+            separators = separators.reshape(n_lines, n_tokens)
+            # n_lines newlines in the chunk, all at the end of a row, and no empty tokens
+            if np.all(buffer[separators[:, -1]] == ord("\n")) and not is_space[0] and \
+                    not np.any(is_space[1:] & is_space[:-1]):
+                self._separators = separators
+                self.n_tokens = np.full(n_lines, n_tokens)
+                return
+
+        # tokens on a line are the ones between the previous and this line end
+        is_token = ~is_space
+        self._starts = np.flatnonzero(is_token[1:] & is_space[:-1]) + 1
+        if len(buffer) > 0 and is_token[0]:
+            self._starts = np.concatenate([[0], self._starts])
+        self._ends = np.flatnonzero(is_token[:-1] & is_space[1:]) + 1  # chunks end with a newline, so every token ends
+        next_token = np.searchsorted(self._starts, np.flatnonzero(buffer == ord("\n")))
+        self._first_token = np.concatenate([[0], next_token[:-1]])
+        self.n_tokens = next_token - self._first_token
+
+    def field(self, field):
+        # Returns (lines, starts, ends) of the tokens of the given field. lines are the lines having the field,
+        # or None if all lines have it
+        if self._separators is not None:
+            n_tokens = self._separators.shape[1]
+            if field >= n_tokens:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+            if field == 0:
+                starts = np.concatenate([[0], self._separator_column(n_tokens - 1)[:-1] + 1])
+            else:
+                starts = self._separator_column(field - 1) + 1
+            return None, starts, self._separator_column(field)
+
+        lines = np.flatnonzero(self.n_tokens > field)
+        tokens = self._first_token[lines] + field
+        return lines, self._starts[tokens], self._ends[tokens]
+
+    def _separator_column(self, column):
+        # contiguous copy of a column of the separator matrix, which is faster to compute with
+        if column not in self._columns:
+            self._columns[column] = self._separators[:, column].copy()
+        return self._columns[column]
+
+
+def _word_view(data):
+    # words[i] is bytes i - 8, ..., i - 1 of the chunk as a little-endian uint64, for i in 0, ..., len(chunk) + 8
+    # (data is the chunk with padding)
+    return np.ndarray((len(data) - _PADDING + 1,), dtype="<u8", buffer=data, strides=(1,))
+
+
+def _parse_digits(words, lengths):
+    # Value of the digits in the last lengths (0 to 8) bytes of words, and whether these are all digits.
+    # The other bytes are 0 after subtracting "0" from the digits, and the eight digits are combined with a few
+    # multiplications (SWAR)
+    mask = _TOKEN_MASKS[lengths]
+    digits = (words & mask) - (_ZEROS & mask)
+    valid = (digits | (digits + (_ABOVE_NINE & mask))) & _HIGH_BITS == 0
+    digits = digits * np.uint64(10) + (digits >> np.uint64(8))
+    pairs = np.uint64(0x000000FF000000FF)
+    digits = ((digits & pairs) * np.uint64(100 + (1000000 << 32)) +
+              ((digits >> np.uint64(16)) & pairs) * np.uint64(1 + (10000 << 32))) >> np.uint64(32)
+    return digits.view(np.int64), valid
+
+
+def _parse_ints(buffer, words, starts, ends):
+    # Returns the integer value of each token and whether the token is a valid integer. The last 8 digits of all
+    # tokens are parsed at once from the words ending at the token ends, and digits before these (positions of
+    # 9 or more digits) one digit of all tokens at a time. Tokens of one or two digits (like mapq) are faster to
+    # parse one digit at a time
+    lengths = ends - starts
+    max_length = int(lengths.max()) if len(starts) > 0 else 0
+    if max_length > 2:
+        n_parsed = 8
+        values, valid = _parse_digits(words[ends], np.minimum(lengths, 8) if max_length > 8 else lengths)
+    else:
+        n_parsed = 0
+        values, valid = np.zeros(len(starts), dtype=np.int64), np.ones(len(starts), dtype=bool)
+    positions = ends - 1 - n_parsed
+    for i in range(n_parsed, max_length):
+        active = lengths > i
+        digits = buffer[positions] - np.uint8(ord("0"))  # wraps around for bytes below 0
+        valid &= ~active | (digits < 10)
+        values += (digits * active).astype(np.int64) * 10**i
+        positions -= 1
+    valid &= lengths > 0
+
+    if not np.all(valid):
+        # "-" is not a digit, so negative numbers are parsed again without it
+        negative = np.flatnonzero(~valid & (buffer[starts] == ord("-")))
+        if len(negative) > 0:
+            values[negative], valid[negative] = _parse_ints(buffer, words, starts[negative] + 1, ends[negative])
+            values[negative] *= -1
+            valid[negative] &= buffer[starts[negative] + 1] != ord("-")
+    return values, valid
+
+
+def _token_strings(buffer, starts, ends):
+    lengths = ends - starts
+    width = max(int(lengths.max()), 1) if len(starts) > 0 else 1
+    matrix = np.zeros((len(starts), width), dtype=np.uint8)
+    for i in range(width):
+        active = i < lengths
+        matrix[active, i] = buffer[starts[active] + i]
+    return matrix.view("S%d" % width).ravel()
+
+
+def _token_keys(words, starts, ends):
+    # Tokens of up to 8 bytes as uint64 (the bytes of the token followed by zeros)
+    return words[starts + _PADDING] & _KEY_MASKS[ends - starts]
+
+
+def _is_null(buffer, starts, ends):
+    return (ends - starts == 4) & (_token_strings(buffer, starts, np.minimum(ends, starts + 4)) == b"null")
+
+
+def _lookup(names, keys):
+    # Index of each key in names (sorted), or any index for keys not in names. Uses a multiplicative hash table
+    # in which the names do not collide, which is much faster than a binary search when there are few names
+    for bits in range(max(len(names).bit_length() + 1, 4), 21):
+        hashes = (names * _HASH_MULTIPLIER) >> np.uint64(64 - bits)
+        if len(np.unique(hashes)) == len(names):
+            table = np.zeros(2**bits, dtype=np.int64)
+            table[hashes] = np.arange(len(names))
+            return table[(keys * _HASH_MULTIPLIER) >> np.uint64(64 - bits)]
+    return np.minimum(np.searchsorted(names, keys), len(names) - 1)
+
+
+def _unique_inverse(keys):
+    # np.unique(keys, return_inverse=True) for keys with few distinct values (like chromosomes): the distinct values
+    # of a sample are found first, and all keys are looked up among these
+    names = np.unique(keys[::64])
+    while True:
+        inverse = _lookup(names, keys)
+        missing = names[inverse] != keys
+        if not np.any(missing):
+            return names, inverse
+        names = np.union1d(names, keys[missing])
+
+
+def _parse_chromosomes(buffer, words, starts, ends, default):
+    from .numpy_alignments import encode_chromosome
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if (ends - starts).max() <= 8:
+        keys, inverse = _unique_inverse(_token_keys(words, starts, ends))
+        names = keys.view("S8")
+    else:
+        names, inverse = np.unique(_token_strings(buffer, starts, ends), return_inverse=True)
+    codes = np.zeros(len(names), dtype=np.int64)
+    for i, name in enumerate(names):
+        name = name.decode()
+        if name == "null":
+            codes[i] = default
+            continue
+        try:
+            codes[i] = encode_chromosome(name)
+        except ValueError:
+            logging.error("Could not parse chromosome %s. Setting to %d" % (name, default))
+            codes[i] = default
+    return codes[inverse.ravel()]
+
+
+def _parse_read_ids(buffer, words, starts, ends):
+    # Vectorized name_to_id: 123 gives 123, 123/1 and 123/2 give 246 and 247. Returns read ids, whether
+    # each name is valid and whether any valid name is paired (has /1 or /2)
+    read_ids, valid = _parse_ints(buffer, words, starts, ends)
+    if np.all(valid):
+        return read_ids, valid, False
+
+    # names with a slash are not valid integers. The pair id after the slash is usually one digit
+    invalid = np.flatnonzero(~valid)
+    invalid_starts, invalid_ends = starts[invalid], ends[invalid]
+    slash = invalid_ends - 2
+    if not np.all(buffer[slash] == ord("/")):
+        slashes = np.append(np.flatnonzero(buffer == ord("/")), len(buffer))
+        slash = slashes[np.searchsorted(slashes, invalid_starts)]
+    has_slash = (slash >= invalid_starts) & (slash < invalid_ends)
+    invalid, invalid_starts, invalid_ends, slash = invalid[has_slash], invalid_starts[has_slash], invalid_ends[has_slash], slash[has_slash]
+    names, names_valid = _parse_ints(buffer, words, invalid_starts, slash)
+    pair_ids, pair_valid = _parse_ints(buffer, words, slash + 1, invalid_ends)
+    read_ids[invalid] = names * 2 + pair_ids - 1
+    valid[invalid] = names_valid & pair_valid
+    return read_ids, valid, bool(np.any(valid[invalid]))
+
+
+def parse_chunk(chunk, columns, first_line_number=0):
+    # Parses whole lines into a dict of column name to values, one value for each line having all required fields,
+    # and "paired", which is True if some read name is paired (/1 or /2). Missing optional fields get the column
+    # default. The chunk is padded with _PADDING spaces on both sides (see read_chunks), so that 8 bytes can be
+    # read before and after any token
+    buffer = np.frombuffer(chunk, dtype=np.uint8, offset=_PADDING, count=len(chunk) - 2 * _PADDING)
+    words = _word_view(chunk)
+    tokens = _Tokens(buffer, np.count_nonzero(buffer == ord("\n")))
+    n_lines = tokens.n_lines
+
+    parsed = {}
+    paired = False
+    has_required = tokens.n_tokens > 0  # skip empty lines
+    for column in columns:
+        if column.kind == "line_number":
+            parsed[column.name] = np.arange(first_line_number, first_line_number + n_lines)
+            continue
+
+        if not column.optional:
+            has_required &= tokens.n_tokens > column.field
+        token_lines, token_starts, token_ends = tokens.field(column.field)
+
+        if column.kind == "chromosome":
+            column_values = _parse_chromosomes(buffer, words, token_starts, token_ends, column.default)
+        elif column.kind == "read_id":
+            column_values, valid, paired = _parse_read_ids(buffer, words, token_starts, token_ends)
+            if not np.all(valid):
+                logging.error("Could not parse %d read names. Skipping these lines" % np.count_nonzero(~valid))
+                has_required[np.flatnonzero(~valid) if token_lines is None else token_lines[~valid]] = False
+        else:
+            ints, valid = _parse_ints(buffer, words, token_starts, token_ends)
+            invalid = ~valid
+            if np.any(invalid):
+                invalid[invalid] = ~_is_null(buffer, token_starts[invalid], token_ends[invalid])
+                if np.any(invalid):
+                    logging.error("Could not parse %d values of %s. Setting these to %d" % (np.count_nonzero(invalid), column.name, column.default))
+                ints[~valid] = column.default
+            column_values = ints
+
+        if token_lines is None:
+            values = column_values
+        else:
+            values = np.full(n_lines, column.default, dtype=np.int64)
+            values[token_lines] = column_values
+
+        if column.optional:
+            parsed[column.name + "_present"] = tokens.n_tokens > column.field
+        parsed[column.name] = values
+
+    if np.all(has_required):
+        parsed["paired"] = paired
+        return parsed
+
+    n_skipped = np.count_nonzero(~has_required & (tokens.n_tokens > 0))
+    if n_skipped > 0:
+        logging.error("Skipping %d lines with too few fields" % n_skipped)
+
+    parsed = {name: values[has_required] for name, values in parsed.items()}
+    parsed["paired"] = paired
+    return parsed
+
+
+class ColumnWriter:
+    # Writes parsed chunks by read id to full size columns of a format: ColumnArrays to arrays in memory and
+    # pipeline._StoreColumns to a store. Subclasses implement _set, _positions_dtype and _widen_positions, and
+    # may select rows in _rows. Positions are the last column, so that they can be widened to int64 if a position
+    # does not fit in int32
+    def __init__(self, columns, n_alignments):
+        self.n_alignments = n_alignments
+        self._columns = [column for column in columns if column.name != "read_ids"]
+        self._columns.sort(key=lambda column: column.name == "positions")
+        self._is_present = {column.name: False for column in self._columns if column.optional}
+        self.paired = False  # True if some read name is paired (/1 or /2)
+
+    def add(self, parsed):
+        self.paired |= parsed["paired"]
+        read_ids = parsed["read_ids"]
+        if len(read_ids) == 0:
+            return
+        if read_ids.min() < 0 or read_ids.max() >= self.n_alignments:
+            raise Exception("Read id %d is larger than number of alignments (%d)" % (read_ids.max(), self.n_alignments))
+
+        rows, selected = self._rows(read_ids)
+        for column in self._columns:
+            values = parsed[column.name]
+            if selected is not None:
+                values = values[selected]
+            if column.optional:
+                present = parsed[column.name + "_present"]
+                if np.any(~present) and not np.all(~present):
+                    logging.warning("%d lines have no %s" % (np.count_nonzero(~present), column.name))
+                self._is_present[column.name] |= bool(np.any(present))
+            if len(values) == 0:
+                continue
+            if column.name == "positions" and self._positions_dtype() == np.int32 and \
+                    (values.max() > INT32_MAX or values.min() < INT32_MIN):
+                logging.info("Positions do not fit in int32. Using int64 for positions")
+                self._widen_positions()
+            self._set(column, rows, values)
+
+    def _rows(self, read_ids):
+        # Returns the rows of the read ids, and which of the parsed values to write (None for all)
+        if read_ids[-1] - read_ids[0] == len(read_ids) - 1 and np.all(read_ids[1:] > read_ids[:-1]):
+            # consecutive read ids (files sorted by read id), which are much faster to set as a slice
+            return slice(int(read_ids[0]), int(read_ids[-1]) + 1), None
+        return read_ids, None
+
+
+class ColumnArrays(ColumnWriter):
+    # Full size arrays of all columns of a format, filled with parsed chunks by read id
+    def __init__(self, columns, n_alignments):
+        super().__init__(columns, n_alignments)
+        self.arrays = {column.name: np.full(n_alignments, column.default, dtype=column.dtype) for column in self._columns}
+
+    def _set(self, column, rows, values):
+        self.arrays[column.name][rows] = values
+
+    def _positions_dtype(self):
+        return self.arrays["positions"].dtype
+
+    def _widen_positions(self):
+        self.arrays["positions"] = self.arrays["positions"].astype(np.int64)
+
+    def result(self):
+        # Optional columns not present on any line are left out
+        return {name: array for name, array in self.arrays.items() if self._is_present.get(name, True)}
+
+
+def read_columns(input_file, format_name, n_alignments, chunk_size=CHUNK_SIZE):
+    # Reads a whole file (opened in binary mode) of the given format into a dict of column name to arrays
+    # indexed by read id. Returns the dict and whether the reads are paired (some read name has /1 or /2)
+    columns = FORMATS[format_name]
+    arrays = ColumnArrays(columns, n_alignments)
+    n_lines = 0
+    count_lines = any(column.kind == "line_number" for column in columns)
+    for chunk, first_line_number in read_chunks(input_file, chunk_size, count_lines):
+        parsed = parse_chunk(chunk, columns, first_line_number)
+        arrays.add(parsed)
+        if (n_lines + len(parsed["read_ids"])) // LOG_INTERVAL > n_lines // LOG_INTERVAL:
+            logging.info("Parsed %d lines" % (n_lines + len(parsed["read_ids"])))
+        n_lines += len(parsed["read_ids"])
+
+    return arrays.result(), arrays.paired
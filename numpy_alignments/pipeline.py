@@ -0,0 +1,235 @@
+import logging
+import queue
+import threading
+import time
+import numpy as np
+from .parsing import _PADDING, CHUNK_SIZE, FORMATS, LOG_INTERVAL, ColumnWriter, parse_chunk, read_chunks
+from .sampling import sample_mask, sample_read_ids, sampling_metadata
+from .store import StoreWriter, provenance, store_file_name
+
+# Pipelined ingestion of text formats (pos, truth, bed, vgpos) directly to a store:
+#   reader thread -> bounded queue of raw chunks -> parser threads -> bounded queue of parsed chunks -> writer
+# The writer (the calling thread) scatters each parsed chunk into the memory mapped columns of the store, so
+# nothing but the queued chunks is kept in memory.
+# The time the reader is blocked on a full queue and the time the parsers wait on an empty queue tell whether
+# ingestion is limited by parsing/writing (CPU-bound) or by reading the input (I/O-bound).
+
+_DONE = None
+
+
+class PipelineStats:
+    def __init__(self):
+        self.read_time = 0.0  # time spent in read calls
+        self.reader_blocked_time = 0.0  # time the reader waited for space in the raw chunk queue
+        self.parse_time = 0.0  # summed over parser threads
+        self.parser_waiting_time = 0.0  # time parsers waited for raw chunks, summed over parser threads
+        self.parser_blocked_time = 0.0  # time parsers waited for space in the parsed chunk queue
+        self.write_time = 0.0
+        self.writer_waiting_time = 0.0  # time the writer waited for parsed chunks
+        self.n_chunks = 0
+        self.n_bytes = 0
+        self.n_lines = 0
+        self.total_time = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **times):
+        with self._lock:
+            for name, value in times.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def verdict(self):
+        # A full raw chunk queue means the reader is waiting for the parsers and writer.
+        # An empty queue means the parsers are waiting for the reader.
+        if self.reader_blocked_time > self.parser_waiting_time:
+            return "CPU-bound"
+        return "I/O-bound"
+
+    def report(self):
+        logging.info("Ingested %d lines (%.1f MB in %d chunks) in %.2f sec (%.1f MB/sec)"
+                     % (self.n_lines, self.n_bytes / 1e6, self.n_chunks, self.total_time,
+                        self.n_bytes / 1e6 / max(self.total_time, 1e-9)))
+        logging.info("Reader: %.2f sec reading, %.2f sec blocked on full queue" % (self.read_time, self.reader_blocked_time))
+        logging.info("Parsers: %.2f sec parsing, %.2f sec waiting on empty queue, %.2f sec blocked on full queue"
+                     % (self.parse_time, self.parser_waiting_time, self.parser_blocked_time))
+        logging.info("Writer: %.2f sec writing, %.2f sec waiting on empty queue" % (self.write_time, self.writer_waiting_time))
+        logging.info("Ingestion was %s" % self.verdict())
+
+
+def _put(to_queue, item, stop):
+    # Blocking put that gives up when the pipeline is stopped. Returns time spent blocked
+    start = time.perf_counter()
+    while not stop.is_set():
+        try:
+            to_queue.put(item, timeout=0.1)
+            break
+        except queue.Full:
+            continue
+    return time.perf_counter() - start
+
+
+def _get(from_queue, stop):
+    # Blocking get that gives up when the pipeline is stopped. Returns the item and time spent waiting
+    start = time.perf_counter()
+    while not stop.is_set():
+        try:
+            return from_queue.get(timeout=0.1), time.perf_counter() - start
+        except queue.Empty:
+            continue
+    return _DONE, time.perf_counter() - start
+
+
+class _StoreColumns(ColumnWriter):
+    # Writes parsed chunks by read id to a store
+    def __init__(self, file_name, format_name, n_alignments, header, sampling=None):
+        super().__init__(FORMATS[format_name], n_alignments)
+        self._sampling = sampling
+        self._sampled_read_ids = None
+        n_rows = n_alignments
+        if sampling is not None:
+            # only the sampled reads are stored, in order of read id
+            self._sampled_read_ids = sample_read_ids(n_alignments, sampling["fraction"], sampling["seed"])
+            n_rows = len(self._sampled_read_ids)
+        self._chromosomes = set()
+
+        column_types = {}
+        if not any(column.name == "mapqs" for column in self._columns):
+            column_types["mapqs"] = (np.uint8, "raw")  # formats without mapqs get mapq 0
+        for column in self._columns:
+            # n_variants is only used as a boolean, and is stored bit-packed
+            column_types[column.name] = (np.uint8, "packbits") if column.name == "n_variants" else (column.dtype, "raw")
+        if sampling is not None:
+            column_types = dict(read_ids=(np.int64, "raw"), **column_types)
+        self._writer = StoreWriter(file_name, n_rows, column_types, header)
+        if sampling is not None:
+            self._writer.write("read_ids", 0, self._sampled_read_ids)
+
+        # unparsed rows get the column defaults
+        for column in self._columns:
+            if column.default != 0:
+                self._writer.write(column.name, 0, np.full(n_rows, column.default, dtype=column.dtype))
+
+    def _rows(self, read_ids):
+        if self._sampling is None:
+            return super()._rows(read_ids)
+        in_sample = sample_mask(read_ids, self._sampling["fraction"], self._sampling["seed"])
+        return np.searchsorted(self._sampled_read_ids, read_ids[in_sample]), in_sample
+
+    def _set(self, column, rows, values):
+        if column.name == "chromosomes":
+            # as stored (e.g. * is -1, stored as 255)
+            self._chromosomes.update(np.unique(values.astype(column.dtype)).tolist())
+        self._writer.scatter(column.name, rows, values)
+
+    def _positions_dtype(self):
+        return np.dtype(self._writer.columns["positions"]["dtype"])
+
+    def _widen_positions(self):
+        self._writer.widen("positions", np.int64)
+
+    def close(self):
+        from .numpy_alignments import contig_dictionary
+        # Optional columns not present on any line are left out, except mapqs, which are 0 as for formats without mapqs
+        for name, is_present in self._is_present.items():
+            if is_present:
+                continue
+            if name == "mapqs":
+                logging.warning("No mapqs in input. Setting mapq to 0 for all alignments")
+            else:
+                self._writer.remove(name)
+        self._writer.header["contigs"] = contig_dictionary(np.array(sorted(self._chromosomes), dtype=np.uint8))
+        if self.paired:
+            self._writer.header["paired"] = True
+        self._writer.close()
+
+    def abort(self):
+        self._writer.abort()
+
+
+def ingest(input_file, format_name, file_name, n_alignments, n_threads=1, chunk_size=CHUNK_SIZE, queue_size=4,
+           sample_fraction=None, sample_seed=0):
+    # Reads a text file (opened in binary mode) of the given format and writes it to a store.
+    # If sample_fraction is set, only the reads in the hash based sample are stored (see sampling.py).
+    # Returns PipelineStats
+    columns = FORMATS[format_name]
+    file_name = store_file_name(file_name)
+    stats = PipelineStats()
+    raw_chunks = queue.Queue(maxsize=queue_size)
+    parsed_chunks = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def reader():
+        try:
+            chunks = read_chunks(input_file, chunk_size, any(column.kind == "line_number" for column in columns))
+            while True:
+                start = time.perf_counter()
+                chunk = next(chunks, _DONE)
+                stats.add(read_time=time.perf_counter() - start)
+                if chunk is _DONE:
+                    break
+                stats.add(reader_blocked_time=_put(raw_chunks, chunk, stop), n_chunks=1, n_bytes=len(chunk[0]) - 2 * _PADDING)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            for _ in range(n_threads):
+                _put(raw_chunks, _DONE, stop)
+
+    def parser():
+        try:
+            while True:
+                item, waited = _get(raw_chunks, stop)
+                stats.add(parser_waiting_time=waited)
+                if item is _DONE:
+                    break
+                chunk, first_line_number = item
+                start = time.perf_counter()
+                parsed = parse_chunk(chunk, columns, first_line_number)
+                stats.add(parse_time=time.perf_counter() - start)
+                stats.add(parser_blocked_time=_put(parsed_chunks, parsed, stop))
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(parsed_chunks, _DONE, stop)
+
+    header = {"class": "NumpyAlignments", "sort_order": "read_id", "provenance": [provenance()]}
+    sampling = None
+    if sample_fraction is not None and sample_fraction < 1:
+        sampling = sampling_metadata(sample_fraction, sample_seed)
+        header["sampling"] = sampling
+    store = _StoreColumns(file_name, format_name, n_alignments, header, sampling)
+    threads = [threading.Thread(target=reader, daemon=True)] + \
+              [threading.Thread(target=parser, daemon=True) for _ in range(n_threads)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    try:
+        n_done = 0
+        while n_done < n_threads:
+            parsed, waited = _get(parsed_chunks, stop)
+            stats.add(writer_waiting_time=waited)
+            if parsed is _DONE:
+                n_done += 1
+                continue
+            start = time.perf_counter()
+            store.add(parsed)
+            n_lines = stats.n_lines
+            stats.add(write_time=time.perf_counter() - start, n_lines=len(parsed["read_ids"]))
+            if stats.n_lines // LOG_INTERVAL > n_lines // LOG_INTERVAL:
+                logging.info("Parsed %d lines" % stats.n_lines)
+
+        for thread in threads:
+            thread.join()
+        if len(errors) > 0:
+            raise errors[0]
+        store.close()
+    except BaseException:
+        stop.set()
+        store.abort()
+        raise
+
+    stats.total_time = time.perf_counter() - start_time
+    stats.report()
+    return stats
@@ -0,0 +1,82 @@
+import logging
+import os
+import numpy as np
+
+# Secondary index of (truth) alignments sorted by chromosome and position, used to find the reads in a region
+# with binary search instead of scanning all alignments.
+# order: rows sorted by (chromosome, position), positions: the positions in that order, and
+# offsets: {chromosome code: (first, last)} giving the slice of order and positions for each chromosome.
+# Stored in a store as the columns region_index_order and region_index_positions, and offsets in the header.
+
+
+class RegionIndex:
+    def __init__(self, order, positions, offsets):
+        self.order = order
+        self.positions = positions
+        self.offsets = {int(chromosome): (int(first), int(last)) for chromosome, (first, last) in offsets.items()}
+
+    @classmethod
+    def from_alignments(cls, chromosomes, positions):
+        chromosomes = np.asarray(chromosomes)
+        positions = np.asarray(positions)
+        order = np.lexsort((positions, chromosomes))
+        order = order.astype(np.uint32 if len(order) < 2**32 else np.int64)
+        sorted_chromosomes = chromosomes[order]
+        codes = np.unique(sorted_chromosomes)
+        firsts = np.searchsorted(sorted_chromosomes, codes, side="left")
+        lasts = np.searchsorted(sorted_chromosomes, codes, side="right")
+        logging.info("Built region index of %d alignments on %d chromosomes" % (len(order), len(codes)))
+        return cls(order, positions[order], dict(zip(codes.tolist(), zip(firsts.tolist(), lasts.tolist()))))
+
+    def columns(self):
+        return {"region_index_order": self.order, "region_index_positions": self.positions}
+
+    def header(self):
+        # json keys are strings
+        return {str(chromosome): [first, last] for chromosome, (first, last) in self.offsets.items()}
+
+    def rows_in_region(self, chromosome, start, end):
+        # Rows with position in [start, end) on chromosome, in coordinate order
+        if chromosome not in self.offsets:
+            return np.zeros(0, dtype=np.int64)
+        first, last = self.offsets[chromosome]
+        positions = self.positions[first:last]
+        return np.asarray(self.order[first + np.searchsorted(positions, start):first + np.searchsorted(positions, end)],
+                          dtype=np.int64)
+
+    def rows_in_regions(self, regions):
+        # Sorted rows in any of the regions [(chromosome, start, end), ...]
+        rows = [self.rows_in_region(chromosome, start, end) for chromosome, start, end in regions]
+        return np.unique(np.concatenate(rows)) if len(rows) > 0 else np.zeros(0, dtype=np.int64)
+
+
+def _encode_region_chromosome(name, contigs):
+    from .numpy_alignments import encode_chromosome
+    if name in contigs:
+        return contigs[name]
+    return encode_chromosome(name)
+
+
+def parse_regions(regions, contigs=None):
+    # regions is a bed file or comma-separated regions chr:start-end (1-based, inclusive like samtools).
+    # Returns a list of (chromosome code, start, end) with 0-based start and exclusive end
+    contigs = contigs if contigs is not None else {}
+    parsed = []
+    if os.path.isfile(regions):
+        with open(regions) as f:
+            for line in f:
+                if line.startswith(("#", "track", "browser")) or line.strip() == "":
+                    continue
+                fields = line.split()
+                parsed.append((_encode_region_chromosome(fields[0], contigs), int(fields[1]), int(fields[2])))
+    else:
+        for region in regions.split(","):
+            try:
+                name, interval = region.rsplit(":", 1)
+                start, end = interval.split("-")
+                parsed.append((_encode_region_chromosome(name, contigs), int(start) - 1, int(end)))
+            except ValueError:
+                raise Exception("Invalid region %s. Must be a bed file or chr:start-end" % region)
+
+    logging.info("%d regions, covering %d bp" % (len(parsed), sum(end - start for chromosome, start, end in parsed)))
+    return parsed
@@ -0,0 +1,56 @@
+import hashlib
+import json
+import logging
+import os
+from .store import find_file
+
+# Cache of ROC curves on disk, one json file per aligner file, truth file and comparison parameters.
+# Files are identified by a fingerprint (path, size and modification time), so a curve is recomputed when
+# the aligner or truth file is rewritten. Stale entries are simply never looked up again.
+
+CACHE_VERSION = 1
+
+
+def default_cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "numpy_alignments")
+
+
+def fingerprint(file_name):
+    file_name = os.path.abspath(find_file(file_name))
+    stat = os.stat(file_name)
+    return [file_name, stat.st_size, stat.st_mtime_ns]
+
+
+class RocCache:
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir if cache_dir is not None else default_cache_dir()
+
+    def _key(self, alignments_file, truth_file, parameters):
+        key = dict(version=CACHE_VERSION, alignments=fingerprint(alignments_file), truth=fingerprint(truth_file),
+                   **parameters)
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def _file_name(self, alignments_file, truth_file, parameters):
+        return os.path.join(self.cache_dir, self._key(alignments_file, truth_file, parameters) + ".json")
+
+    def get(self, alignments_file, truth_file, **parameters):
+        # Returns the cached curve, or None if there is no up-to-date curve. parameters are everything else
+        # the curve depends on (allowed mismatch, type, mapq intervals, ...)
+        file_name = self._file_name(alignments_file, truth_file, parameters)
+        if not os.path.isfile(file_name):
+            return None
+        try:
+            with open(file_name) as f:
+                return json.load(f)
+        except ValueError:
+            logging.warning("Ignoring corrupt cache entry %s" % file_name)
+            return None
+
+    def put(self, alignments_file, truth_file, curve, **parameters):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        file_name = self._file_name(alignments_file, truth_file, parameters)
+        # written to a temporary file first, so that concurrent reports never read a partial entry
+        with open(file_name + ".tmp%d" % os.getpid(), "w") as f:
+            json.dump(curve, f)
+        os.replace(file_name + ".tmp%d" % os.getpid(), file_name)
@@ -0,0 +1,79 @@
+import logging
+import numpy as np
+
+# Deterministic subsampling of reads by a hash of the read id. A read is in the sample with fraction f if
+# splitmix64((read id // 2) ^ key(seed)) < f * 2**64, so
+#   - both mates of a pair (read ids 2k and 2k + 1) are in or out of the sample together
+#   - the same reads are selected in the truth and in all aligners, whether they are sampled when stored or when compared
+#   - the sample is unbiased with respect to read id (unlike taking the first reads)
+#   - a sample with a smaller fraction (same seed) is a subset of a sample with a larger fraction, so a stored
+#     sample can be sampled further and give the same reads as sampling the full set
+
+HASH = "splitmix64_pair"
+
+
+def splitmix64(values):
+    x = np.asarray(values, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _threshold(fraction):
+    assert 0 < fraction <= 1, "Sample fraction must be in (0, 1]"
+    return min(int(fraction * 2**64), 2**64 - 1)
+
+
+def sample_mask(read_ids, fraction, seed=0):
+    # True for read ids in the sample
+    if fraction >= 1:
+        return np.ones(len(read_ids), dtype=bool)
+    key = splitmix64(np.array([seed]))[0]
+    pair_ids = np.asarray(read_ids, dtype=np.uint64) >> np.uint64(1)
+    return splitmix64(pair_ids ^ key) < np.uint64(_threshold(fraction))
+
+
+def sample_read_ids(n_reads, fraction, seed=0, chunk_size=16 * 1024 * 1024):
+    # Sorted ids of the reads in the sample among read ids 0, ..., n_reads - 1
+    read_ids = [start + np.flatnonzero(sample_mask(np.arange(start, min(start + chunk_size, n_reads)), fraction, seed))
+                for start in range(0, n_reads, chunk_size)]
+    read_ids = np.concatenate(read_ids) if len(read_ids) > 0 else np.zeros(0, dtype=np.int64)
+    logging.info("Sampled %d of %d reads (fraction %.4f)" % (len(read_ids), n_reads, fraction))
+    return read_ids
+
+
+def sampling_metadata(fraction, seed=0):
+    return {"fraction": fraction, "seed": seed, "hash": HASH}
+
+
+def common_sampling(alignments, fraction=None):
+    # Returns (fraction, seed) of the sample all alignments (a list) can be compared on: the given fraction, or
+    # the smallest fraction any of the alignments were stored with. None if there is no sampling
+    samplings = [a.metadata.get("sampling") for a in alignments if a.metadata.get("sampling") is not None]
+    if any(sampling.get("hash") != HASH for sampling in samplings):
+        raise Exception("Alignments are sampled with an older sampling method. Store them again to compare them")
+    seeds = set(sampling["seed"] for sampling in samplings)
+    if len(seeds) > 1:
+        raise Exception("Alignments are sampled with different seeds (%s) and cannot be compared" % ",".join(map(str, seeds)))
+    seed = seeds.pop() if len(seeds) > 0 else 0
+
+    smallest = min([sampling["fraction"] for sampling in samplings], default=None)
+    if fraction is None:
+        fraction = smallest
+    elif smallest is not None and fraction > smallest:
+        logging.warning("Alignments are stored with sample fraction %.4f. Using this instead of %.4f" % (smallest, fraction))
+        fraction = smallest
+
+    if fraction is None or fraction >= 1:
+        return None
+    return fraction, seed
+
+
+def common_sample(alignments, fraction=None):
+    # Subsamples all alignments (a list) to the same reads (see common_sampling)
+    sampling = common_sampling(alignments, fraction)
+    if sampling is None:
+        return alignments
+    return [a.subsample(*sampling) for a in alignments]
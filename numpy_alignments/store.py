@@ -0,0 +1,317 @@
+import datetime
+import json
+import logging
+import os
+import struct
+import sys
+import numpy as np
+from .columns import PackedBoolArray
+
+# Store format (version 1):
+# A 64 byte preamble (magic, format version, offset and length of the header), followed by the columns, each
+# starting at a 64 byte aligned offset, followed by a json header describing the columns (dtype, encoding,
+# offset, length), the class that wrote the file, sort order, contig dictionary and provenance.
+# Columns are written in place, so they can be written in chunks and memory mapped when read.
+
+MAGIC = b"\x93NPALIGN"
+FORMAT_VERSION = 1
+FILE_SUFFIX = ".npa"
+_PREAMBLE = struct.Struct("<8sQQQ")
+_PREAMBLE_SIZE = 64
+_ALIGNMENT = 64
+
+
+def store_file_name(file_name):
+    if file_name.endswith(FILE_SUFFIX):
+        return file_name
+    if file_name.endswith(".npz"):
+        file_name = file_name[:-4]
+    return file_name + FILE_SUFFIX
+
+
+def find_file(file_name):
+    for candidate in (file_name, file_name + FILE_SUFFIX, file_name + ".npz"):
+        if os.path.isfile(candidate):
+            return candidate
+    raise FileNotFoundError("Could not find alignments file %s" % file_name)
+
+
+def detect_format(file_name):
+    # Returns store, npz (files written by NumpyAlignments before the store format) or
+    # shared_memory_wrapper (files written by NumpyAlignments2 before the store format)
+    with open(file_name, "rb") as f:
+        start = f.read(8)
+    if start == MAGIC:
+        return "store"
+    elif start.startswith(b"PK"):
+        return "npz"
+    return "shared_memory_wrapper"
+
+
+def provenance(**fields):
+    try:
+        from importlib.metadata import version
+        package_version = version("numpy_alignments")
+    except Exception:
+        package_version = "unknown"
+
+    return dict(command=" ".join(sys.argv),
+                created=datetime.datetime.now().isoformat(),
+                numpy_alignments_version=package_version,
+                **fields)
+
+
+def _stored_length(encoding, length):
+    # number of elements stored for a column with length rows
+    if encoding == "packbits":
+        return (length + 7) // 8
+    return length
+
+
+class StoreWriter:
+    # Writes a store with the given columns ({name: (dtype, encoding)}, encoding is raw or packbits), all with
+    # n_alignments rows. Columns can be written in chunks (write) or by row index (scatter).
+    # The file is written to a temporary file that replaces file_name on close, so that a store can be
+    # rewritten while it is memory mapped.
+    def __init__(self, file_name, n_alignments, columns, header=None):
+        self.file_name = file_name
+        self._tmp_file_name = file_name + ".tmp"
+        self.n_alignments = n_alignments
+        self.header = dict(header) if header is not None else {}
+        self.columns = {}
+        offset = _PREAMBLE_SIZE
+        for name, (dtype, encoding) in columns.items():
+            assert encoding in ("raw", "packbits"), "Invalid encoding %s" % encoding
+            dtype = np.dtype(dtype if encoding == "raw" else np.uint8)
+            self.columns[name] = dict(dtype=dtype.str, encoding=encoding, offset=offset, length=n_alignments)
+            offset += dtype.itemsize * _stored_length(encoding, n_alignments)
+            offset += -offset % _ALIGNMENT
+        self._data_end = offset
+
+        self._file = open(self._tmp_file_name, "w+b")
+        self._file.truncate(self._data_end)
+        self._memmaps = {}
+
+    def _memmap(self, name):
+        if name not in self._memmaps:
+            column = self.columns[name]
+            self._file.flush()
+            self._memmaps[name] = np.memmap(self._file, dtype=column["dtype"], mode="r+", offset=column["offset"],
+                                            shape=(_stored_length(column["encoding"], column["length"]),))
+        return self._memmaps[name]
+
+    def write(self, name, start, values):
+        # Writes values to rows start, start + 1, ... of a column
+        column = self.columns[name]
+        values = np.asarray(values)
+        assert start + len(values) <= column["length"], "Writing past end of column %s" % name
+        if column["encoding"] == "packbits":
+            assert start % 8 == 0, "Chunks of packed columns must start at a multiple of 8"
+            data = np.packbits(values != 0)
+            offset = column["offset"] + start // 8
+        else:
+            data = values.astype(column["dtype"], copy=False)
+            offset = column["offset"] + start * data.itemsize
+
+        self._file.seek(offset)
+        self._file.write(np.ascontiguousarray(data).tobytes())
+
+    def write_packed(self, name, start, packed):
+        # Writes bits already packed with np.packbits to rows start * 8, start * 8 + 1, ... of a packbits column
+        column = self.columns[name]
+        assert column["encoding"] == "packbits"
+        assert start + len(packed) <= _stored_length("packbits", column["length"])
+        self._file.seek(column["offset"] + start)
+        self._file.write(np.ascontiguousarray(packed, dtype=np.uint8).tobytes())
+
+    def scatter(self, name, indices, values):
+        # Sets rows indices (an array or a slice) of a column to values
+        column = self.columns[name]
+        memmap = self._memmap(name)
+        if column["encoding"] == "packbits":
+            indices = np.arange(indices.start, indices.stop) if isinstance(indices, slice) else np.asarray(indices)
+            values = np.asarray(values) != 0
+            bits = (1 << (7 - (indices & 7))).astype(np.uint8)
+            np.bitwise_or.at(memmap, indices[values] >> 3, bits[values])
+            np.bitwise_and.at(memmap, indices[~values] >> 3, ~bits[~values])
+        else:
+            memmap[indices] = values
+
+    def widen(self, name, dtype):
+        # Changes the dtype of the last column to a larger dtype, keeping the values written so far
+        column = self.columns[name]
+        assert name == list(self.columns)[-1], "Only the last column can be widened"
+        assert column["encoding"] == "raw"
+        values = np.array(self._memmap(name))
+        del self._memmaps[name]
+        dtype = np.dtype(dtype)
+        column["dtype"] = dtype.str
+        self._data_end = column["offset"] + dtype.itemsize * column["length"]
+        self._data_end += -self._data_end % _ALIGNMENT
+        self._file.truncate(self._data_end)
+        self.write(name, 0, values)
+
+    def remove(self, name):
+        # Leaves a column out of the header (the space of the column is left unused)
+        if name in self._memmaps:
+            del self._memmaps[name]
+        del self.columns[name]
+
+    def close(self):
+        for memmap in self._memmaps.values():
+            memmap.flush()
+        self._memmaps = {}
+
+        header = dict(self.header, format_version=FORMAT_VERSION, n_alignments=self.n_alignments, columns=self.columns)
+        header_bytes = json.dumps(header).encode()
+        self._file.seek(self._data_end)
+        self._file.write(header_bytes)
+        self._file.seek(0)
+        self._file.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, self._data_end, len(header_bytes)))
+        self._file.close()
+        os.replace(self._tmp_file_name, self.file_name)
+        logging.info("Wrote %d alignments to %s" % (self.n_alignments, self.file_name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        # Discards the file being written
+        self._memmaps = {}
+        self._file.close()
+        if os.path.exists(self._tmp_file_name):  # not if close failed after renaming it
+            os.remove(self._tmp_file_name)
+
+
+def write_store(file_name, columns, header=None):
+    # columns: {name: array or PackedBoolArray}
+    n_alignments = len(next(iter(columns.values())))
+    column_types = {name: (np.uint8, "packbits") if isinstance(column, PackedBoolArray) else (column.dtype, "raw")
+                    for name, column in columns.items()}
+    with StoreWriter(file_name, n_alignments, column_types, header) as writer:
+        for name, column in columns.items():
+            if isinstance(column, PackedBoolArray):
+                writer.write_packed(name, 0, column.packed)
+            else:
+                writer.write(name, 0, column)
+
+
+def read_header(file_name):
+    with open(file_name, "rb") as f:
+        magic, version, header_offset, header_length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        assert magic == MAGIC, "%s is not an alignments store" % file_name
+        if version > FORMAT_VERSION:
+            raise Exception("%s has format version %d, only version %d and older is supported. Upgrade numpy_alignments"
+                            % (file_name, version, FORMAT_VERSION))
+        f.seek(header_offset)
+        return json.loads(f.read(header_length))
+
+
+def read_store(file_name):
+    # Returns the header and all columns, memory mapped
+    header = read_header(file_name)
+    columns = {}
+    for name, column in header["columns"].items():
+        length = _stored_length(column["encoding"], column["length"])
+        if length == 0:
+            data = np.zeros(0, dtype=column["dtype"])
+        else:
+            data = np.memmap(file_name, dtype=column["dtype"], mode="r", offset=column["offset"], shape=(length,))
+        if column["encoding"] == "packbits":
+            data = PackedBoolArray(data, column["length"])
+        columns[name] = data
+    return header, columns
+
+
+def _read_npy_header(f):
+    # Returns (shape, dtype) and leaves f at the start of the data
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    return shape, dtype
+
+
+def _npz_columns(npz_file_name):
+    # {column name: (shape, dtype)} of an npz file, read from the npy headers only
+    import zipfile
+    columns = {}
+    with zipfile.ZipFile(npz_file_name) as zip_file:
+        for name in zip_file.namelist():
+            if name.endswith(".npy"):
+                with zip_file.open(name) as f:
+                    columns[name[:-len(".npy")]] = _read_npy_header(f)
+    return columns
+
+
+def _iter_npz_column(npz_file_name, name, chunk_size):
+    # Reads a column of an npz file in chunks without loading the whole column
+    import zipfile
+    with zipfile.ZipFile(npz_file_name) as zip_file:
+        with zip_file.open(name + ".npy") as f:
+            shape, dtype = _read_npy_header(f)
+            n = int(np.prod(shape))
+            for start in range(0, n, chunk_size):
+                count = min(chunk_size, n - start)
+                yield np.frombuffer(f.read(count * dtype.itemsize), dtype=dtype)
+
+
+def convert(old_file_name, new_file_name, chunk_size=8 * 1024 * 1024):
+    # Upgrades a file written before the store format to a store. Files written by NumpyAlignments (npz) are
+    # converted one chunk of one column at a time.
+    new_file_name = store_file_name(new_file_name)
+    old_format = detect_format(old_file_name)
+    logging.info("Converting %s (%s) to %s" % (old_file_name, old_format, new_file_name))
+    if old_format == "store":
+        raise Exception("%s is already a store" % old_file_name)
+    elif old_format == "shared_memory_wrapper":
+        from .numpy_alignments import NumpyAlignments2
+        NumpyAlignments2.from_legacy_file(old_file_name).to_file(new_file_name)
+        return
+
+    # only the npy headers are read here, the columns are read in chunks below
+    data = _npz_columns(old_file_name)
+    n_alignments = int(np.prod(data["positions"][0]))
+    column_types = {"chromosomes": (data["chromosomes"][1], "raw"),
+                    "positions": (data["positions"][1], "raw"),
+                    "mapqs": (data["mapqs"][1], "raw")}
+    if "scores" in data:
+        column_types["scores"] = (data["scores"][1], "raw")
+    if "n_variants_packed" in data or "n_variants" in data:
+        column_types["n_variants"] = (np.uint8, "packbits")
+    if "is_correct_packed" in data or ("is_correct" in data and int(np.prod(data["is_correct"][0])) > 0):
+        column_types["is_correct"] = (np.uint8, "packbits")
+
+    from .numpy_alignments import contig_dictionary
+    contigs = {}
+    header = {"class": "NumpyAlignments", "sort_order": "read_id", "contigs": contigs,
+              "provenance": [provenance(converted_from=os.path.abspath(old_file_name))]}
+    chunk_size -= chunk_size % 8
+    with StoreWriter(new_file_name, n_alignments, column_types, header) as writer:
+        for name in column_types:
+            if name + "_packed" in data:
+                for start, chunk in _chunks_with_start(_iter_npz_column(old_file_name, name + "_packed", chunk_size)):
+                    writer.write_packed(name, start, chunk)
+                continue
+
+            for start, chunk in _chunks_with_start(_iter_npz_column(old_file_name, name, chunk_size)):
+                writer.write(name, start, chunk)
+                if name == "chromosomes":
+                    contigs.update(contig_dictionary(chunk))
+
+    logging.info("Converted %s to %s" % (old_file_name, new_file_name))
+
+
+def _chunks_with_start(chunks):
+    start = 0
+    for chunk in chunks:
+        yield start, chunk
+        start += len(chunk)
+
@@ -0,0 +1,71 @@
+import logging
+import numpy as np
+from .numpy_alignments import encode_chromosome, encode_contigs
+
+
+class VariantPositions:
+    # Sorted (0-based) variant positions for each chromosome (encoded with encode_chromosome).
+    # Used to count the number of variants covered by each read.
+    def __init__(self, positions):
+        self.positions = positions
+
+    @classmethod
+    def from_dict(cls, positions_by_name):
+        positions = {}
+        for name, chromosome_positions in positions_by_name.items():
+            try:
+                chromosome = encode_chromosome(name)
+            except ValueError:
+                logging.warning("Ignoring variants on chromosome %s" % name)
+                continue
+            positions[chromosome] = np.sort(np.asarray(chromosome_positions, dtype=np.int64))
+
+        logging.info("%d variants on %d chromosomes" % (sum(len(p) for p in positions.values()), len(positions)))
+        return cls(positions)
+
+    @classmethod
+    def from_vcf(cls, file_name):
+        import bionumpy as bnp
+        positions = {}
+        for chunk in bnp.open(file_name).read_chunks():
+            for name, variants in bnp.groupby(chunk, "chromosome"):
+                positions.setdefault(name, []).append(variants.position)
+
+        return cls.from_dict({name: np.concatenate(p) for name, p in positions.items()})
+
+    @classmethod
+    def from_coordinate_map(cls, file_name):
+        # Coordinate map from graph_read_simulator. The reference coordinates in the map are the positions where the
+        # haplotype differs from the reference (what the simulator counts as variants)
+        from shared_memory_wrapper import from_file
+        coordinate_map = from_file(file_name)
+        return cls.from_dict({name: chromosome_map.reference for name, chromosome_map in coordinate_map._coordinate_maps.items()})
+
+    def count_variants(self, chromosomes, starts, ends):
+        # Number of variants in [start, end) for each read
+        counts = np.zeros(len(chromosomes), dtype=np.uint32)
+        if len(chromosomes) == 0:
+            return counts
+        # sorting on chromosome (a radix sort for uint8) gives the reads on each chromosome as one slice
+        order = np.argsort(chromosomes, kind="stable")
+        sorted_chromosomes = np.asarray(chromosomes)[order]
+        boundaries = np.flatnonzero(sorted_chromosomes[1:] != sorted_chromosomes[:-1]) + 1
+        for first, last in zip(np.concatenate([[0], boundaries]), np.concatenate([boundaries, [len(order)]])):
+            chromosome = int(sorted_chromosomes[first])
+            if chromosome not in self.positions:
+                continue
+            reads = order[first:last]
+            variant_positions = self.positions[chromosome]
+            counts[reads] = np.searchsorted(variant_positions, ends[reads]) - np.searchsorted(variant_positions, starts[reads])
+
+        logging.info("%d of %d reads cover variants" % (np.count_nonzero(counts), len(counts)))
+        return counts
+
+    def annotate(self, alignments, read_length=150):
+        # Sets n_variants of alignments (typically truth alignments) from the variants covered by each read
+        chromosomes = alignments.chromosomes
+        if not (isinstance(chromosomes, np.ndarray) and np.issubdtype(chromosomes.dtype, np.integer)):
+            # contig names (e.g. bam), encoded the same way as the variant chromosomes
+            chromosomes, _ = encode_contigs(chromosomes.tolist())
+        starts = np.asarray(alignments.positions, dtype=np.int64)
+        alignments.n_variants = self.count_variants(chromosomes, starts, starts + read_length)
@@ -0,0 +1,106 @@
+import io
+import numpy as np
+import pytest
+from numpy_alignments.numpy_alignments import encode_chromosome, name_to_id
+from numpy_alignments.parsing import FORMATS, read_columns
+
+# The vectorized parser is compared with a per-line reference (str.split, int, name_to_id and encode_chromosome,
+# as the loops it replaced)
+
+
+def reference_columns(text, format_name, n_alignments):
+    columns = [column for column in FORMATS[format_name] if column.name != "read_ids"]
+    values = {column.name: np.full(n_alignments, column.default, dtype=np.int64) for column in columns}
+    present = {column.name: False for column in columns}
+    for line_number, line in enumerate(text.splitlines()):
+        fields = line.split()
+        if len(fields) == 0:
+            continue
+        read_id = [column for column in FORMATS[format_name] if column.name == "read_ids"][0]
+        read_id = line_number if read_id.kind == "line_number" else name_to_id(fields[read_id.field])
+        for column in columns:
+            if column.field >= len(fields):
+                continue
+            present[column.name] = True
+            field = fields[column.field]
+            if field == "null":
+                value = column.default
+            elif column.kind == "chromosome":
+                value = encode_chromosome(field)
+            else:
+                try:
+                    value = int(field)
+                except ValueError:
+                    value = column.default  # logged and set to the default
+            values[column.name][read_id] = value
+    # optional columns not present on any line are left out
+    return {name: array for name, array in values.items()
+            if present[name] or not [column for column in columns if column.name == name][0].optional}
+
+
+POS = ("0\t1\t900\t60\t150\n"
+       "1\tX\t123456789\t0\t-20\n"  # 9 digits, negative score
+       "2/1 chr2\t2147483648 3 7\r\n"  # paired name, mixed tabs and spaces, above int32, crlf
+       "2/2\tY\t-15\t255\t1\n"  # negative position
+       "3\tnull\tnull\t2\t3\n"
+       "6\t5\t12345678901  \t1\t0\n"  # 11 digits, trailing spaces
+       "7\t22\t77\n"  # no mapq and score
+       "\n"
+       "8\t3  \t 8\t9\t10\r\n"
+       "9\t4\t-\t1x\t--3\n")  # invalid values
+
+TRUTH = ("000000000 X 195856304 a b c d 0\n"
+         "000000001 chr3 51341987 a b c d 3\r\n"
+         "1/1 1 null a b c d 1\n"
+         "1/2\t7\t-4 a\tb c d\n"  # no n_variants
+         "000000004 null 123456789012 a b c d null\n")
+
+
+@pytest.mark.parametrize("chunk_size", [16, 64, 1024 * 1024])
+@pytest.mark.parametrize("format_name,text,n_alignments", [("pos", POS, 10), ("truth", TRUTH, 6)], ids=["pos", "truth"])
+def test_read_columns_matches_per_line_reference(format_name, text, n_alignments, chunk_size):
+    columns, paired = read_columns(io.BytesIO(text.encode()), format_name, n_alignments, chunk_size=chunk_size)
+    expected = reference_columns(text, format_name, n_alignments)
+    assert sorted(columns) == sorted(expected)
+    for name in expected:
+        assert np.array_equal(columns[name], expected[name].astype(columns[name].dtype)), name
+    assert paired
+
+
+def test_positions_above_int32_are_widened():
+    columns, _ = read_columns(io.BytesIO(POS.encode()), "pos", 10)
+    assert columns["positions"].dtype == np.int64
+    assert columns["positions"][4] == 2147483648
+    assert columns["positions"][5] == -15
+    assert columns["positions"][6] == 12345678901
+
+    columns, _ = read_columns(io.BytesIO(b"0\t1\t900\t60\t150\n"), "pos", 1)
+    assert columns["positions"].dtype == np.int32
+
+
+def test_missing_optional_columns_are_left_out():
+    columns, paired = read_columns(io.BytesIO(b"0 1 900\n1 2 800\n"), "pos", 2)
+    assert "mapqs" not in columns and "scores" not in columns
+    assert list(columns["positions"]) == [900, 800]
+    assert not paired
+
+
+def test_bed_and_vgpos():
+    bed = "chr1\t100\t250\t0\t60\t+\n2 5 9 1/2 60 -\r\nnull\tnull\t0\t3\n"
+    columns, paired = read_columns(io.BytesIO(bed.encode()), "bed", 4)
+    expected = reference_columns(bed, "bed", 4)
+    assert all(np.array_equal(columns[name], expected[name].astype(columns[name].dtype)) for name in expected)
+    assert paired
+
+    vgpos = "a b 1 100\nc d chrX 2200000000\n\ne f null 7\n"
+    columns, _ = read_columns(io.BytesIO(vgpos.encode()), "vgpos", 4)
+    expected = reference_columns(vgpos, "vgpos", 4)
+    assert all(np.array_equal(columns[name], expected[name].astype(columns[name].dtype)) for name in expected)
+
+
+def test_invalid_values_are_logged(caplog):
+    read_columns(io.BytesIO(POS.encode()), "pos", 10)
+    errors = [record.getMessage() for record in caplog.records if record.levelname == "ERROR"]
+    assert sorted(errors) == ["Could not parse 1 values of mapqs. Setting these to 0",
+                              "Could not parse 1 values of positions. Setting these to 0",
+                              "Could not parse 1 values of scores. Setting these to 0"]
@@ -0,0 +1,53 @@
+import numpy as np
+from numpy_alignments.columns import PackedBoolArray
+from numpy_alignments.numpy_alignments import NumpyAlignments
+from numpy_alignments.store import convert, read_store, write_store
+
+
+def random_alignments(n_alignments, seed=0):
+    rng = np.random.default_rng(seed)
+    return dict(chromosomes=rng.integers(1, 25, n_alignments).astype(np.uint8),
+                positions=rng.integers(0, 2**31 - 1, n_alignments).astype(np.int32),
+                mapqs=rng.integers(0, 61, n_alignments).astype(np.uint8),
+                scores=rng.integers(0, 300, n_alignments).astype(np.uint16),
+                n_variants=rng.integers(0, 3, n_alignments).astype(np.uint8),
+                is_correct=rng.integers(0, 2, n_alignments).astype(bool))
+
+
+def test_write_and_read_store(tmp_path):
+    columns = random_alignments(1001)
+    stored = dict(columns, is_correct=PackedBoolArray.from_array(columns["is_correct"]))
+    write_store(str(tmp_path / "a.npa"), stored, {"sort_order": "read_id"})
+    header, read = read_store(str(tmp_path / "a.npa"))
+    assert header["sort_order"] == "read_id" and header["n_alignments"] == 1001
+    for name, values in columns.items():
+        assert np.array_equal(np.asarray(read[name]), values), name
+        assert np.asarray(read[name]).dtype == values.dtype or name == "is_correct"
+
+
+def test_alignments_round_trip(tmp_path):
+    columns = random_alignments(100)
+    alignments = NumpyAlignments(columns["chromosomes"], columns["positions"], columns["n_variants"], columns["scores"],
+                                 columns["mapqs"], columns["is_correct"])
+    alignments.metadata["paired"] = True
+    alignments.to_file(str(tmp_path / "a"))
+    loaded = NumpyAlignments.from_file(str(tmp_path / "a"))
+    assert loaded.metadata["paired"] and loaded.metadata["sort_order"] == "read_id"
+    for name in ["chromosomes", "positions", "mapqs", "scores"]:
+        assert np.array_equal(getattr(loaded, name), columns[name]), name
+    assert np.array_equal(loaded.variants_mask(), columns["n_variants"] > 0)
+    assert np.array_equal(loaded.correct_mask(), columns["is_correct"])
+
+
+def test_convert_npz(tmp_path):
+    # files written before the store format, with is_correct and n_variants as one uint8 per alignment
+    columns = random_alignments(5000, seed=1)
+    columns["positions"] = columns["positions"].astype(np.int64)
+    np.savez(str(tmp_path / "old.npz"), **dict(columns, is_correct=columns["is_correct"].astype(np.uint8)))
+    convert(str(tmp_path / "old.npz"), str(tmp_path / "new"), chunk_size=777)
+    assert (tmp_path / "new.npa").exists()
+    loaded = NumpyAlignments.from_file(str(tmp_path / "new.npa"))
+    for name in ["chromosomes", "positions", "mapqs", "scores"]:
+        assert np.array_equal(getattr(loaded, name), columns[name]), name
+    assert np.array_equal(loaded.variants_mask(), columns["n_variants"] > 0)
+    assert np.array_equal(loaded.correct_mask(), columns["is_correct"])